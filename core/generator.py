@@ -1,7 +1,15 @@
 import carla
 import numpy as np
-import math
-from scipy.interpolate import interp1d
+import bisect
+
+try:
+    from numba import njit
+except ImportError:
+    # numba 为可选依赖：缺失时退化为普通 Python 函数（结果一致，只是慢）
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda fn: fn
 
 # ============================================================
 # 坐标系约定（最终与 Anchor3DLane/OpenLane 预处理兼容）
@@ -75,39 +83,72 @@ def _T_apollo_to_openlane() -> np.ndarray:
     T[2, :3] = [0, -1, 0]
     return T
 
-def _project_ground_to_uv(points_ground_3xN: np.ndarray, E_cam_to_ground: np.ndarray, K: np.ndarray, W: int, H: int, zmin=0.1):
+def _inv_rigid(T: np.ndarray) -> np.ndarray:
+    """
+    刚体变换 [R|t] 的快速求逆（R 正交）：inv = [R^T | -R^T t]
+    比通用 np.linalg.inv 少一次 LU 分解。
+    """
+    T_inv = np.eye(4, dtype=np.float64)
+    R_t = T[:3, :3].T
+    T_inv[:3, :3] = R_t
+    T_inv[:3, 3] = -R_t @ T[:3, 3]
+    return T_inv
+
+def _apply44(M: np.ndarray, pts3xN: np.ndarray) -> np.ndarray:
+    """
+    对 3xN 点做 4x4 齐次变换，返回 3xN：
+      (M @ [p; 1])[:3] == M[:3, :3] @ p + M[:3, 3]
+    不拼 ones 行，省掉 4xN 的临时数组。
+    """
+    return M[:3, :3] @ pts3xN + M[:3, 3:4]
+
+@njit(cache=True)
+def _mono_mask(y, min_dy):
+    """
+    单调滤波核：y 已按升序排好，只保留比上一个保留点大 min_dy 以上的点。
+    返回长度 N 的 bool mask。
+    y 必须是 float64：numba 版里 last 从 -inf 起步是 float64，纯 Python 版里 last 跟随 y 的 dtype，
+    传 float32 时两者的 last + min_dy 舍入不同，装不装 numba 会保留不同的点。
+    """
+    n = y.shape[0]
+    mask = np.zeros(n, dtype=np.bool_)
+    last = -np.inf
+    for i in range(n):
+        if y[i] > last + min_dy:
+            mask[i] = True
+            last = y[i]
+    return mask
+
+def _project_ground_to_uv(points_ground_3xN: np.ndarray, P_ground: np.ndarray, W: int, H: int, zmin=0.1):
     """
     与 projection_g2im_extrinsic(E,K) 完全一致的投影方式：
-      P = K * inv(E)[:3,:]   (ground -> cam)
-      uv = P * [X,Y,Z,1]
+      P = K * inv(E)[:3,:]   (ground -> cam)，由调用方每帧算一次后传入
+      uv = P * [X,Y,Z,1] = P[:, :3] * [X,Y,Z] + P[:, 3]
     这里 points_ground 用的是我们的 ground/ego 坐标(x右,y前,z上)。
     """
     if points_ground_3xN.shape[1] == 0:
         return np.zeros((2, 0), dtype=np.float32), np.zeros((0,), dtype=np.float32)
 
-    P = K @ np.linalg.inv(E_cam_to_ground)[0:3, :]  # 3x4
-    N = points_ground_3xN.shape[1]
-    pts_h = np.vstack([points_ground_3xN, np.ones((1, N), dtype=np.float64)])  # 4xN
-
-    proj = P @ pts_h  # 3xN
+    # 不拼齐次坐标 4xN，直接 R*p + t
+    proj = _apply44(P_ground, points_ground_3xN)  # 3xN
     z = proj[2, :]
-    vis = z > zmin
-    z_safe = np.where(vis, z, 1.0)
 
-    u = proj[0, :] / z_safe
-    v = proj[1, :] / z_safe
+    # z <= zmin 的点最终都会被置 -1，这里只需保证除法安全
+    z_safe = np.maximum(z, zmin)
+    uv = proj[:2, :] / z_safe  # 2xN
+    u, v = uv[0], uv[1]
 
-    in_img = (u >= 0) & (u < W) & (v >= 0) & (v < H)
-    vis = vis & in_img
+    vis = (z > zmin) & (u >= 0) & (u < W) & (v >= 0) & (v < H)
 
-    u = np.where(vis, u, -1.0).astype(np.float32)
-    v = np.where(vis, v, -1.0).astype(np.float32)
-    return np.stack([u, v], axis=0), vis.astype(np.float32)
+    # 不可见点原地写 -1
+    uv[:, ~vis] = -1.0
+    return uv.astype(np.float32), vis.astype(np.float32)
 
 class OpenLaneGenerator:
-    def __init__(self, world, camera_k, img_w=1920, img_h=1280):
+    def __init__(self, world, camera_k, img_w=1920, img_h=1280, carla_map=None):
         self.world = world
-        self.map = world.get_map()
+        # get_map() 每次都要从服务器取一遍 OpenDRIVE，调用方已有 Map 时直接传进来
+        self.map = carla_map if carla_map is not None else world.get_map()
         self.K = np.array(camera_k, dtype=np.float64)
         self.W = int(img_w)
         self.H = int(img_h)
@@ -120,32 +161,47 @@ class OpenLaneGenerator:
 
         # 预处理使用的固定矩阵
         self.T_A2O = _T_apollo_to_openlane()           # Apollo -> OpenLane
-        self.T_O2A = np.linalg.inv(self.T_A2O)         # OpenLane -> Apollo
+        self.T_O2A = self.T_A2O.T                      # OpenLane -> Apollo
 
         self.S_v2g = _swap_vehicle_to_ground()         # vehicle -> ground (x=Y, y=X, z=Z)
         self.S_carlaCam2Apollo = _carla_cam_to_apollo_cam()  # carla cam -> apollo cam
+        self.S_v2g_inv = self.S_v2g.T                                    # ground -> vehicle (置换矩阵)
+        self.S_carlaCam2Apollo_inv = self.S_carlaCam2Apollo.T              # apollo cam -> carla cam
+
+        # 固定安装位姿（与你 sensor_manager 一致），每帧不变
+        tf_sensor_local = carla.Transform(
+            carla.Location(x=1.6, z=1.55),
+            carla.Rotation(pitch=-3.0)
+        )
+        self.T_v_c_static = _mat44_from_carla_transform(tf_sensor_local)  # Vehicle -> CarlaCam
+        self.T_v_c_static_inv = _inv_rigid(self.T_v_c_static)
+
+        # OpenLane 预处理脚本 (openlane.txt) 里的固定矩阵，见 process_frame 末尾
+        self.R_vg = np.array([[0, 1, 0],
+                              [-1, 0, 0],
+                              [0, 0, 1]], dtype=np.float64)
+        self.R_gc = np.array([[1, 0, 0],
+                              [0, 0, 1],
+                              [0, -1, 0]], dtype=np.float64)
+        self.R_vg_inv = self.R_vg.T  # 正交矩阵: inv == T
+        self.R_gc_inv = self.R_gc.T
+
+        # 车道线类别表: (颜色, 线型) -> OpenLane category
+        white, yellow = carla.LaneMarkingColor.White, carla.LaneMarkingColor.Yellow
+        m = carla.LaneMarkingType
+        self._cat = {
+            (white, m.Broken): 1, (white, m.Solid): 2, (white, m.BrokenBroken): 3,
+            (white, m.SolidSolid): 4, (white, m.BrokenSolid): 5, (white, m.SolidBroken): 6,
+            (yellow, m.Broken): 7, (yellow, m.Solid): 8, (yellow, m.BrokenBroken): 9,
+            (yellow, m.SolidSolid): 10, (yellow, m.BrokenSolid): 11, (yellow, m.SolidBroken): 12,
+            (None, m.Curb): 20,
+        }
 
     def _get_category(self, carla_marking_type, carla_marking_color):
-        is_white = (carla_marking_color == carla.LaneMarkingColor.White)
-        is_yellow = (carla_marking_color == carla.LaneMarkingColor.Yellow)
-        m_type = carla_marking_type
-
-        if is_white:
-            if m_type == carla.LaneMarkingType.Broken: return 1
-            elif m_type == carla.LaneMarkingType.Solid: return 2
-            elif m_type == carla.LaneMarkingType.BrokenBroken: return 3
-            elif m_type == carla.LaneMarkingType.SolidSolid: return 4
-            elif m_type == carla.LaneMarkingType.BrokenSolid: return 5
-            elif m_type == carla.LaneMarkingType.SolidBroken: return 6
-        elif is_yellow:
-            if m_type == carla.LaneMarkingType.Broken: return 7
-            elif m_type == carla.LaneMarkingType.Solid: return 8
-            elif m_type == carla.LaneMarkingType.BrokenBroken: return 9
-            elif m_type == carla.LaneMarkingType.SolidSolid: return 10
-            elif m_type == carla.LaneMarkingType.BrokenSolid: return 11
-            elif m_type == carla.LaneMarkingType.SolidBroken: return 12
-        if m_type == carla.LaneMarkingType.Curb: return 20
-        return 0
+        # (color, type) 精确匹配；Curb 不区分颜色，用 (None, type) 兜底
+        return self._cat.get((carla_marking_color, carla_marking_type),
+                             self._cat.get((None, carla_marking_type), 0))
+
     def _enforce_y_monotonic(self, pts3xN: np.ndarray, min_dy: float = 1e-3) -> np.ndarray:
         """
         强制 ground 坐标下 y 单调递增：
@@ -155,24 +211,25 @@ class OpenLaneGenerator:
         if pts3xN.shape[1] < 2:
             return pts3xN
 
-        x, y, z = pts3xN[0], pts3xN[1], pts3xN[2]
-
-        # 1) sort by y
-        idx = np.argsort(y)
-        x, y, z = x[idx], y[idx], z[idx]
+        # 1) sort by y（stable：y 相同时保持采样顺序，结果可复现）
+        idx = np.argsort(pts3xN[1], kind='stable')
+        pts = pts3xN[:, idx]
 
         # 2) keep strictly increasing y
-        keep = [0]
-        last_y = y[0]
-        for i in range(1, y.shape[0]):
-            if y[i] > last_y + min_dy:
-                keep.append(i)
-                last_y = y[i]
-
-        if len(keep) < 2:
+        # 常见情况（0.5m 步长采样）相邻点间距都 > min_dy，整条线保留，纯 NumPy 一次比较判定即可；
+        # 只有出现近重复点（前后拼接处）时才需要逐点扫描。
+        # 快速路径和 _mono_mask 用同一个 float64 的 y、同一个判定式 y[i] > y[i-1] + min_dy，
+        # 快速路径通过时逐点扫描必然全保留，两条路径结果一致
+        y = pts[1].astype(np.float64)
+        if np.all(y[1:] > y[:-1] + min_dy):
+            return pts
+
+        keep = _mono_mask(y, min_dy)
+
+        if np.count_nonzero(keep) < 2:
             return pts3xN[:, :0]  # 返回空，后面会被跳过
 
-        return np.vstack([x[keep], y[keep], z[keep]])
+        return pts[:, keep]
 
 
     def process_frame(self, ego_vehicle, sensor_transform, seg_image=None):
@@ -182,19 +239,14 @@ class OpenLaneGenerator:
           - extrinsic        : Apollo camera -> Ground (4x4)
           - intrinsic        : K (3x3)
         """
-        # 1) 固定安装位姿（与你 sensor_manager 一致）
-        tf_sensor_local = carla.Transform(
-            carla.Location(x=1.6, z=1.55),
-            carla.Rotation(pitch=-3.0)
-        )
-        T_v_c_carla_static = _mat44_from_carla_transform(tf_sensor_local)  # Vehicle -> CarlaCam
+        # 1) 固定安装位姿（与你 sensor_manager 一致），已在 __init__ 里缓存：self.T_v_c_static
 
         # 2) 拍摄时的相机世界位姿 (CarlaCam -> World)
         T_w_c_carla = _mat44_from_carla_transform(sensor_transform)
 
         # 3) 反推拍摄时 Vehicle->World
         # T_w_v = T_w_c * inv(T_v_c)
-        T_w_v_carla = T_w_c_carla @ np.linalg.inv(T_v_c_carla_static)
+        T_w_v_carla = T_w_c_carla @ self.T_v_c_static_inv
 
         # 4) 落地（把 vehicle 原点的 z 固定到路面高度，避免悬挂/坡度抖动）
         ego_loc_temp = carla.Location(
@@ -217,8 +269,8 @@ class OpenLaneGenerator:
         #   world = T_w_v_carla_ground * inv(S_v2g) * ground
         # 因为: ground = S_v2g * vehicle  => vehicle = inv(S_v2g) * ground
         # ============================================================
-        T_w_ground = T_w_v_carla_ground @ np.linalg.inv(self.S_v2g)
-        T_ground_w = np.linalg.inv(T_w_ground)  # World -> Ground
+        T_w_ground = T_w_v_carla_ground @ self.S_v2g_inv
+        T_ground_w = _inv_rigid(T_w_ground)  # World -> Ground
 
         # ============================================================
         # 6) 构造 ApolloCam -> Ground 的外参 E（写入 json）
@@ -228,7 +280,7 @@ class OpenLaneGenerator:
         # => World = T_w_c_carla * inv(S) * ApolloCam
         # => T_w_c_apollo = T_w_c_carla * inv(S)
         # ============================================================
-        T_w_c_apollo = T_w_c_carla @ np.linalg.inv(self.S_carlaCam2Apollo)
+        T_w_c_apollo = T_w_c_carla @ self.S_carlaCam2Apollo_inv
         E_apollo_cam_to_ground = T_ground_w @ T_w_c_apollo  # (ApolloCam -> Ground)
 
         # ============================================================
@@ -251,7 +303,13 @@ class OpenLaneGenerator:
             r2 = r1.get_right_lane()
             if r2: lanes_to_process.append((r2, 1))
 
-        lane_lines = []
+        # ground -> apollo cam -> openlane cam 合成一个 4x4（存入 json 的 xyz）
+        # p_open = T_A2O * T_apollo_from_ground * p_ground
+        T_apollo_from_ground = _inv_rigid(E_apollo_cam_to_ground)  # Ground -> ApolloCam
+        M_g2o = self.T_A2O @ T_apollo_from_ground                   # Ground -> OpenLaneCam
+        P_ground = self.K @ T_apollo_from_ground[:3, :]              # Ground -> 像素 (3x4)
+
+        candidates = []  # (points_ground, uv, vis, category_id)
         for wp, side in lanes_to_process:
             marking = wp.left_lane_marking if side == -1 else wp.right_lane_marking
             if marking.type == carla.LaneMarkingType.NONE:
@@ -269,43 +327,41 @@ class OpenLaneGenerator:
             # if abs(z_mean) > 0.5:
             #     continue
 
-            # 投影（用 E_apollo_cam_to_ground + K）
-            uv, vis = _project_ground_to_uv(points_ground, E_apollo_cam_to_ground, self.K, self.W, self.H)
+            # 投影（用 P_ground = K * inv(E_apollo_cam_to_ground)[:3, :]）
+            uv, vis = _project_ground_to_uv(points_ground, P_ground, self.W, self.H)
 
             if np.sum(vis) < 10:
                 continue
 
-            # ground -> apollo cam
-            T_apollo_from_ground = np.linalg.inv(E_apollo_cam_to_ground)  # Ground -> ApolloCam
-            pts_h = np.vstack([points_ground, np.ones((1, points_ground.shape[1]), dtype=np.float64)])
-            pts_apollo = (T_apollo_from_ground @ pts_h)[:3, :]
-
-            # apollo cam -> openlane cam (存入 json 的 xyz)
-            # p_open = T_A2O * p_apollo
-            pts_apollo_h = np.vstack([pts_apollo, np.ones((1, pts_apollo.shape[1]), dtype=np.float64)])
-            pts_open = (self.T_A2O @ pts_apollo_h)[:3, :]
-
-            lane_data = {
-                # ★关键：xyz 存 OpenLane camera frame (3xN) ★
-                "xyz": pts_open.astype(np.float32).tolist(),
-                "uv": uv.tolist(),
-                "visibility": vis.tolist(),
-                "category": int(category_id)
-            }
-            lane_lines.append(lane_data)
-
-        # 简单去重（按 y 起点）
+            candidates.append((points_ground, uv, vis, category_id))
+
+        # 所有 lane 的 ground 点拼成 3 x ΣN，一次矩阵乘法转到 OpenLane camera，再按偏移切回
         unique_lanes = []
-        for lane in lane_lines:
-            is_dup = False
-            if len(lane["xyz"]) > 0 and len(unique_lanes) > 0:
-                curr_y_start = lane["xyz"][1][0]
-                for exist in unique_lanes:
-                    if len(exist["xyz"]) > 0 and abs(exist["xyz"][1][0] - curr_y_start) < 0.2:
-                        is_dup = True
-                        break
-            if not is_dup:
-                unique_lanes.append(lane)
+        if candidates:
+            pts_ground_all = np.hstack([c[0] for c in candidates])
+            pts_open_all = _apply44(M_g2o, pts_ground_all)
+            offsets = np.cumsum([c[0].shape[1] for c in candidates])[:-1]
+
+            # 简单去重（按 y 起点）：已保留的 y 起点放在有序表里，只需和二分位置两侧的邻居比较
+            # xyz/uv/visibility 保持 ndarray，由 core.io_handler.dump_json 直接序列化
+            kept_y0 = []
+            for (_, uv, vis, category_id), pts_open in zip(candidates, np.split(pts_open_all, offsets, axis=1)):
+                xyz = pts_open.astype(np.float32)
+                y0 = float(xyz[1, 0])
+                i = bisect.bisect_left(kept_y0, y0)
+                if (i > 0 and y0 - kept_y0[i - 1] < 0.2) or (i < len(kept_y0) and kept_y0[i] - y0 < 0.2):
+                    continue
+                kept_y0.insert(i, y0)
+
+                lane_data = {
+                    # ★关键：xyz 存 OpenLane camera frame (3xN) ★
+                    "xyz": xyz,
+                    "uv": uv,
+                    "visibility": vis,
+                    "category": int(category_id)
+                }
+                unique_lanes.append(lane_data)
+
         # [新增适配] 逆向工程：生成适配 OpenLane 预处理脚本的外参矩阵
         # ------------------------------------------------------------
         # 目的：预处理脚本 (openlane.txt) 会假设输入是 Waymo 格式，并执行：
@@ -314,22 +370,16 @@ class OpenLaneGenerator:
         # 公式：R_json = R_vg @ R_final @ inv(R_gc) @ inv(R_vg)
         # ============================================================
         
-        # 1. 定义脚本中的变换矩阵 (完全复制自 openlane.txt)
-        R_vg = np.array([[0, 1, 0],
-                         [-1, 0, 0],
-                         [0, 0, 1]], dtype=np.float64)
-                         
-        R_gc = np.array([[1, 0, 0],
-                         [0, 0, 1],
-                         [0, -1, 0]], dtype=np.float64)
+        # 1. 脚本中的变换矩阵 (完全复制自 openlane.txt)，已在 __init__ 里缓存：
+        #    self.R_vg / self.R_gc 及其逆
 
         # 2. 取出我们需要脚本最终得到的旋转矩阵 (Target)
         # E_apollo_cam_to_ground 是 4x4，我们只处理前 3x3 旋转部分
         R_target = E_apollo_cam_to_ground[:3, :3]
 
         # 3. 执行逆运算计算 R_json
-        # 注意：R_gc 是正交矩阵，inv(R_gc) == R_gc.T，这里直接用 inv 保持数学直观
-        R_json = R_vg @ R_target @ np.linalg.inv(R_gc) @ np.linalg.inv(R_vg)
+        # 注意：R_gc / R_vg 是正交矩阵，inv == 转置（见 __init__）
+        R_json = self.R_vg @ R_target @ self.R_gc_inv @ self.R_vg_inv
 
         # 4. 组装最终写入 JSON 的外参矩阵
         # 脚本只修改旋转矩阵，平移向量 (Translation) 会被直接读取。
@@ -355,14 +405,14 @@ class OpenLaneGenerator:
         step = self.sample_step
 
         def collect_points(start_wp, move_forward=True):
-            collected = []
+            """返回 (n, 3) 的 World 边界点（按行走顺序）"""
             curr = start_wp
             dist = 0.0
 
             if not move_forward:
                 prevs = curr.previous(step)
                 if not prevs:
-                    return []
+                    return np.empty((0, 3), dtype=np.float64)
                 curr = prevs[0]
                 dist += step
 
@@ -370,33 +420,32 @@ class OpenLaneGenerator:
             max_loops = int(target_dist / step) + 20
             loop_guard = 0
 
+            # 预分配缓冲区，按下标写入，避免逐点 list.append
+            # 范围过滤不在这里逐点做，见循环后的向量化 mask
+            buf = np.empty((max_loops, 3), dtype=np.float64)
+            n = 0
+
+            # 循环里只剩 CARLA 调用，常量/属性查找提到循环外
+            marking_none = carla.LaneMarkingType.NONE
+            use_left = (side == -1)
+            half_side = 0.5 * side
+
             while dist < target_dist and loop_guard < max_loops:
                 loop_guard += 1
 
-                marking = curr.left_lane_marking if side == -1 else curr.right_lane_marking
-                if marking.type == carla.LaneMarkingType.NONE:
+                marking = curr.left_lane_marking if use_left else curr.right_lane_marking
+                if marking.type == marking_none:
                     break
 
                 trans = curr.transform
                 center_loc = trans.location
                 right_vec = trans.get_right_vector()
-                half_width = curr.lane_width / 2.0
-
-                bx = center_loc.x + right_vec.x * half_width * side
-                by = center_loc.y + right_vec.y * half_width * side
-                bz = center_loc.z + right_vec.z * half_width * side
-
-                p_world = np.array([bx, by, bz, 1.0], dtype=np.float64)
+                offset = curr.lane_width * half_side
 
-                # World -> Ground: p_ground = T_ground_w * p_world
-                p_ground = (T_ground_w @ p_world)[:3]
-
-                # ground: x右 y前 z上
-                x_g, y_g, z_g = float(p_ground[0]), float(p_ground[1]), float(p_ground[2])
-
-                # 前方/后方距离 & 横向范围过滤（按 ground 的 y / x 来过滤更符合预处理）
-                if (y_g > -self.back_dist) and (y_g < self.max_dist) and (abs(x_g) < self.lateral_range):
-                    collected.append([x_g, y_g, z_g])
+                buf[n] = (center_loc.x + right_vec.x * offset,
+                          center_loc.y + right_vec.y * offset,
+                          center_loc.z + right_vec.z * offset)
+                n += 1
 
                 # 移动 waypoint
                 if move_forward:
@@ -412,18 +461,25 @@ class OpenLaneGenerator:
 
                 dist += step
 
-            return collected
+            return buf[:n]
 
         fwd_points = collect_points(start_waypoint, move_forward=True)
         bwd_points = collect_points(start_waypoint, move_forward=False)
-        all_points = bwd_points[::-1] + fwd_points
+        pts_world = np.concatenate([bwd_points[::-1], fwd_points], axis=0)  # (N, 3)
+
+        # World -> Ground: p_ground = T_ground_w * p_world（整条线一次矩阵乘法）
+        # ground: x右 y前 z上
+        pts_ground = _apply44(T_ground_w, pts_world.T)  # 3xN
+
+        # 前方/后方距离 & 横向范围过滤（按 ground 的 y / x 来过滤更符合预处理）
+        x_g, y_g = pts_ground[0], pts_ground[1]
+        keep = (y_g > -self.back_dist) & (y_g < self.max_dist) & (np.abs(x_g) < self.lateral_range)
 
-        if len(all_points) < 2:
+        if np.count_nonzero(keep) < 2:
             return np.zeros((3, 0), dtype=np.float32)
         
         #在生成阶段让 y 单调（不靠预处理擦屁股）
-        pts = np.array(all_points, dtype=np.float32).T  # 3xN
+        pts = pts_ground[:, keep].astype(np.float32)  # 3xN
         pts = self._enforce_y_monotonic(pts, min_dy=1e-3)
         return pts
 
-        #return np.array(all_points, dtype=np.float32).T  # 3xN
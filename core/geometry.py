@@ -50,25 +50,25 @@ class GeometryUtils:
         if len(points_3d) == 0:
             return np.array([]), np.array([]), np.array([])
 
-        points_np = np.array(points_3d)
-        
+        # 内部统一用列存储 (3, N)，矩阵左乘，不需要转置常量矩阵
+        pts = np.asarray(points_3d, dtype=np.float64).T  # (3, N)
+
         # 1. World -> Camera Frame
-        # 构造齐次坐标 (N, 4)
-        points_hom = np.hstack((points_np, np.ones((len(points_np), 1))))
-        # 矩阵乘法: (N, 4) @ (4, 4).T -> (N, 4)
-        points_cam_hom = np.dot(points_hom, extrinsic.T)
-        points_cam = points_cam_hom[:, :3]
+        # 构造齐次坐标 (4, N)
+        pts_h = np.vstack((pts, np.ones((1, pts.shape[1]))))
+        # 矩阵乘法: (4, 4) @ (4, N) -> (4, N)
+        points_cam = (extrinsic @ pts_h)[:3]
 
         # 2. Camera -> Image Plane
-        # (N, 3) @ (3, 3).T -> (N, 3)
-        points_img = np.dot(points_cam, K.T)
+        # (3, 3) @ (3, N) -> (3, N)
+        points_img = K @ points_cam
         
         # 3. 透视除法
-        z = points_img[:, 2:3]
-        valid_mask = (z > 0).flatten()
+        z = points_img[2]
+        valid_mask = z > 0
         
         # 避免除以 0
-        z_safe = np.where(z <= 0, 1e-5, z)
-        uv = points_img[:, :2] / z_safe
+        z_safe = np.where(valid_mask, z, 1e-5)
+        uv = (points_img[:2] / z_safe).T
 
-        return uv, points_cam, valid_mask
\ No newline at end of file
+        return uv, points_cam.T, valid_mask
\ No newline at end of file
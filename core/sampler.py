@@ -11,16 +11,14 @@ class DataSampler:
         self.prefer_junction = args.prefer_junction
         self.weather_quota = args.weather_quota  # 如果是 None 则不限制
         
-        # 数据统计容器
-        # 结构: self.stats[town][category][key] = {'scanned': 0, 'saved': 0}
-        self.stats = collections.defaultdict(
-            lambda: collections.defaultdict(
-                lambda: collections.defaultdict(lambda: {'scanned': 0, 'saved': 0})
-            )
-        )
+        # 数据统计容器 (扁平计数器)
+        # 结构: self.scanned[(town, category, key)] / self.saved[(town, category, key)] = count
+        self.scanned = collections.Counter()
+        self.saved = collections.Counter()
         
         # 全局计数 (用于快速计算均值)
         self.global_lane_counts = collections.defaultdict(int) # {lane_num: saved_count}
+        self._lane_total = 0  # sum(global_lane_counts.values())，在 _commit_save 里增量维护
 
     def check_and_update(self, town, weather, lane_count, road_id, is_junction, simulate=True):
         """
@@ -43,7 +41,7 @@ class DataSampler:
         # A. 天气配额 (Weather Quota)
         # 如果该天气下的保存数量已经超过配额，且没有强制保存理由，则丢弃
         if self.weather_quota is not None:
-            current_weather_saved = self.stats[town]['weather'][weather]['saved']
+            current_weather_saved = self.saved[(town, 'weather', weather)]
             if current_weather_saved >= self.weather_quota:
                 return False
 
@@ -58,8 +56,8 @@ class DataSampler:
         # 使用“动态拒绝采样”算法
         if self.balance_lane and self.global_lane_counts:
             current_count = self.global_lane_counts[lane_count]
-            values = list(self.global_lane_counts.values())
-            avg_count = sum(values) / len(values) if values else 0
+            # 注意上一行的读取会给新类别插入 0，所以类别数直接取 len(dict)
+            avg_count = self._lane_total / len(self.global_lane_counts)
             
             # 如果当前类别的数量 显著超过 平均值 (例如 1.5倍)，则概率性丢弃
             if avg_count > 10 and current_count > avg_count * 1.5:
@@ -86,37 +84,42 @@ class DataSampler:
             self._update_stat(town, 'scene', 'junction', 'saved')
         
         self.global_lane_counts[lane_count] += 1
+        self._lane_total += 1
 
     def _update_stat(self, town, category, key, metric):
-        self.stats[town][category][key][metric] += 1
+        # metric: 'scanned' / 'saved'
+        getattr(self, metric)[(town, category, key)] += 1
 
     def save_report(self, output_path):
         """生成详细的 JSON 报告"""
+        rows = list(self.scanned.keys() | self.saved.keys())  # [(town, category, key)]
         report = {}
-        
-        for town, categories in self.stats.items():
-            report[town] = {}
-            for cat, items in categories.items():
-                report[town][cat] = {}
-                
-                # 计算该类别下的总保存数，用于计算占比
-                total_saved_in_cat = sum(v['saved'] for v in items.values())
-                
-                for key, metrics in items.items():
-                    scanned = metrics['scanned']
-                    saved = metrics['saved']
-                    
-                    # 占比 (Ratio): 占该类总数的百分比
-                    ratio = (saved / total_saved_in_cat) if total_saved_in_cat > 0 else 0.0
-                    # 保存率 (Save Rate): 扫描多少帧里存了多少帧
-                    save_rate = (saved / scanned) if scanned > 0 else 0.0
-                    
-                    report[town][cat][key] = {
-                        "scanned": scanned,
-                        "saved": saved,
-                        "ratio": round(ratio, 4),
-                        "save_rate": round(save_rate, 4)
-                    }
+        if rows:
+            # 每行所属的 (town, category) 组号，用于按组求和
+            group_ids = {}
+            gid = np.fromiter((group_ids.setdefault((t, c), len(group_ids)) for t, c, _ in rows),
+                              dtype=np.int64, count=len(rows))
+            scanned = np.fromiter((self.scanned[r] for r in rows), dtype=np.float64, count=len(rows))
+            saved = np.fromiter((self.saved[r] for r in rows), dtype=np.float64, count=len(rows))
+
+            # 该类别下的总保存数，用于计算占比
+            total_saved = np.bincount(gid, weights=saved)[gid]
+
+            # 占比 (Ratio): 占该类总数的百分比
+            ratio = np.divide(saved, total_saved, out=np.zeros_like(saved), where=total_saved > 0)
+            # 保存率 (Save Rate): 扫描多少帧里存了多少帧
+            save_rate = np.divide(saved, scanned, out=np.zeros_like(saved), where=scanned > 0)
+
+            for (town, cat, key), sc, sv, ra, sr in zip(rows, scanned.astype(np.int64).tolist(),
+                                                       saved.astype(np.int64).tolist(),
+                                                       np.round(ratio, 4).tolist(),
+                                                       np.round(save_rate, 4).tolist()):
+                report.setdefault(town, {}).setdefault(cat, {})[key] = {
+                    "scanned": sc,
+                    "saved": sv,
+                    "ratio": ra,
+                    "save_rate": sr
+                }
 
         with open(output_path, 'w') as f:
             json.dump(report, f, indent=4, sort_keys=True)
@@ -1,6 +1,9 @@
 #遮挡剔除。输入 3D 点 + Depth Map，输出 visibility 数组
 import numpy as np
 
+# 24bit 深度码 -> 米
+_DEPTH_SCALE = np.float32(1000.0 / (256**3 - 1))
+
 class VisibilityHandler:
     @staticmethod
     def decode_carla_depth(image_data_bgra):
@@ -13,41 +16,37 @@ class VisibilityHandler:
             # 这里假设外部已经处理了 reshape，或者传入的是 raw bytes
             pass 
         
-        data = image_data_bgra.astype(np.float32)
-        B, G, R = data[:,:,0], data[:,:,1], data[:,:,2]
-        
-        normalized = (R + G * 256 + B * 256 * 256) / (256**3 - 1)
-        return normalized * 1000.0
+        # 24bit 整数拼接 (B,G,R 通道顺序)，最后只做一次浮点缩放
+        raw = image_data_bgra[:, :, 2].astype(np.uint32)
+        raw |= image_data_bgra[:, :, 1].astype(np.uint32) << 8
+        raw |= image_data_bgra[:, :, 0].astype(np.uint32) << 16
+
+        depth = raw.astype(np.float32)
+        depth *= _DEPTH_SCALE
+        return depth
 
     @staticmethod
     def compute_visibility(uv_points, z_geo_values, depth_map_meters, w, h, threshold=0.4):
         """
         Z-Buffer Test
+        uv_points: (N, 2) 像素坐标, z_geo_values: (N,) 几何深度
         threshold: 遮挡容忍度(米)，防止深度图精度误差导致自遮挡
         """
-        visibility = []
-        
-        for i, (u, v) in enumerate(uv_points):
-            z_real = z_geo_values[i]
-            u_int, v_int = int(u), int(v)
-
-            # 1. 越界检查
-            if u_int < 0 or u_int >= w or v_int < 0 or v_int >= h:
-                visibility.append(0.0)
-                continue
-            
-            if z_real <= 0:
-                visibility.append(0.0)
-                continue
-
-            # 2. 读取传感器深度
-            d_sensor = depth_map_meters[v_int, u_int]
-
-            # 3. 比较
-            # 如果点的几何深度 比 传感器看到的深度 大（远），说明前面有障碍物
-            if z_real > (d_sensor + threshold):
-                visibility.append(0.0)
-            else:
-                visibility.append(1.0)
-
-        return visibility
\ No newline at end of file
+        uv = np.asarray(uv_points, dtype=np.float64).reshape(-1, 2)  # (N, 2)
+        z_geo = np.asarray(z_geo_values, dtype=np.float64).reshape(-1)  # (N,)
+
+        u_i = np.rint(uv[:, 0]).astype(np.int32)
+        v_i = np.rint(uv[:, 1]).astype(np.int32)
+
+        # 1. 越界 / 相机后方检查
+        in_bounds = (u_i >= 0) & (u_i < w) & (v_i >= 0) & (v_i < h) & (z_geo > 0)
+
+        # 2. 读取传感器深度（先 clip，越界点读到的值会被 in_bounds 屏蔽）
+        # 用一维扁平下标做一次 gather，代替二维花式索引
+        u_clip = np.clip(u_i, 0, w - 1).astype(np.int64)
+        v_clip = np.clip(v_i, 0, h - 1).astype(np.int64)
+        d_sensor = depth_map_meters.reshape(-1)[v_clip * depth_map_meters.shape[1] + u_clip]
+
+        # 3. 比较
+        # 如果点的几何深度 比 传感器看到的深度 大（远），说明前面有障碍物
+        return (in_bounds & (z_geo <= d_sensor + threshold)).astype(np.float32)
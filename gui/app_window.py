@@ -1,28 +1,37 @@
 # gui/app_window.py
 import sys
 import os
+import multiprocessing
 import numpy as np
 from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QGridLayout, QLabel, QLineEdit, QPushButton, 
-                             QComboBox, QGroupBox, QTextEdit, QProgressBar, 
+                             QComboBox, QGroupBox, QPlainTextEdit, QProgressBar, 
                              QSpinBox, QTabWidget, QFileDialog, QMessageBox,
                              QSpacerItem, QSizePolicy) # 添加了 Spacer
-from PyQt5.QtCore import Qt, pyqtSlot
-from PyQt5.QtGui import QImage, QPixmap
+from PyQt5.QtCore import Qt, QTimer, QEvent
+from PyQt5.QtGui import QImage, QTextCursor, QIntValidator
 
-from .styles import DARK_THEME
-from .worker import CarlaWorker
+from .worker import CarlaWorker, WEATHER_CODES
+from .preview_label import PreviewLabel
 from .validation_worker import ValidationWorker
 
+def _spin(lo, hi, value):
+    # 这些数值只在点击开始时读取一次：关闭键盘跟踪，输入过程中不逐键触发 valueChanged
+    box = QSpinBox()
+    box.setRange(lo, hi)
+    box.setValue(value)
+    box.setKeyboardTracking(False)
+    return box
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("CARLA OpenLane Studio")
         self.resize(1360, 900) # 稍微加宽一点以容纳更多参数
-        self.setStyleSheet(DARK_THEME)
 
         self.collection_worker = None
         self.validation_worker = None
+        self._last_browse_dir = "."
         
         self.init_ui()
 
@@ -38,9 +47,44 @@ class MainWindow(QMainWindow):
         self.tabs.addTab(self.tab_collection, "Data Collection")
         self.tabs.addTab(self.tab_validation, "Batch Validation")
 
-        # 初始化各个页面
+        # 初始化各个页面：验证页延迟到第一次切换过去时再构建，加快启动
         self.init_collection_ui()
-        self.init_validation_ui()
+        self.init_collection_worker()
+        self._validation_initialized = False
+        self.tabs.currentChanged.connect(self._on_tab_changed)
+
+        # 视频刷新：worker 只覆盖写"最新帧"信箱，由定时器按显示刷新率(~30Hz)取帧绘制，
+        # 中间来不及显示的帧直接被覆盖丢弃，不会在跨线程事件队列里堆积
+        # 每帧都要用到的 Qt 枚举值，绑定一次，避免每帧做模块属性查找
+        self._fmt = QImage.Format_RGB32
+        self._bad_frame_logged = False  # 预览帧格式不对只报一次，避免刷屏
+        self._display_timer = QTimer(self)
+        self._display_timer.timeout.connect(self._flush_frame)
+        self._display_timer.start(33)
+
+        # 日志：log()/log_val() 只往缓冲区里追加，定时器每 100ms 合并成一次插入
+        self._log_buf = []
+        self._val_log_buf = []
+        self._log_timer = QTimer(self)
+        self._log_timer.timeout.connect(self._flush_log)
+        self._log_timer.start(100)
+
+    def _on_tab_changed(self, idx):
+        if idx == 1 and not self._validation_initialized:
+            self.init_validation_ui()
+            self._validation_initialized = True
+        # 预览只在采集页可见，离开采集页时停掉显示定时器 (worker 信箱只保留最新一帧，不会积压)
+        if self.tabs.widget(idx) is self.tab_collection:
+            self._display_timer.start()
+        else:
+            self._display_timer.stop()
+
+    def _row(self, layout, r, text, w):
+        # 表单行：左侧标签 + 右侧控件 (标签设 buddy，快捷键可直接聚焦控件)
+        lbl = QLabel(text)
+        lbl.setBuddy(w)
+        layout.addWidget(lbl, r, 0)
+        layout.addWidget(w, r, 1)
 
     # ==========================================
     # Tab 1: 数据采集 (功能增强版)
@@ -58,8 +102,11 @@ class MainWindow(QMainWindow):
         conn_layout = QGridLayout()
         self.ip_input = QLineEdit("127.0.0.1")
         self.port_input = QLineEdit("2000")
-        conn_layout.addWidget(QLabel("IP:"), 0, 0); conn_layout.addWidget(self.ip_input, 0, 1)
-        conn_layout.addWidget(QLabel("Port:"), 1, 0); conn_layout.addWidget(self.port_input, 1, 1)
+        # 端口号在输入时就校验，不合法时 START 按钮直接置灰
+        self.port_input.setValidator(QIntValidator(1, 65535, self))
+        self.port_input.textChanged.connect(self._update_start_enabled)
+        self._row(conn_layout, 0, "IP:", self.ip_input)
+        self._row(conn_layout, 1, "Port:", self.port_input)
         conn_group.setLayout(conn_layout)
         left_panel.addWidget(conn_group)
 
@@ -76,9 +123,9 @@ class MainWindow(QMainWindow):
         self.segment_input = QLineEdit("segment-0")
         self.segment_input.setPlaceholderText("Folder Name")
         
-        basic_layout.addWidget(QLabel("Map:"), 0, 0); basic_layout.addWidget(self.map_combo, 0, 1)
-        basic_layout.addWidget(QLabel("Split:"), 1, 0); basic_layout.addWidget(self.split_combo, 1, 1)
-        basic_layout.addWidget(QLabel("Name:"), 2, 0); basic_layout.addWidget(self.segment_input, 2, 1)
+        self._row(basic_layout, 0, "Map:", self.map_combo)
+        self._row(basic_layout, 1, "Split:", self.split_combo)
+        self._row(basic_layout, 2, "Name:", self.segment_input)
         basic_group.setLayout(basic_layout)
         left_panel.addWidget(basic_group)
 
@@ -88,41 +135,24 @@ class MainWindow(QMainWindow):
         
         # 天气选择 (对应 WeatherManager)
         self.weather_combo = QComboBox()
-        # 对应你后端 weather_manager.py 的逻辑
-        self.weather_combo.addItems([
-            "Random (Default)",    # 随机
-            "Clear Noon",          # 晴天
-            "Overcast",            # 阴天
-            "Rain",                # 下雨
-            "LongTail: Glare",     # 长尾：眩光
-            "LongTail: Heavy Fog", # 长尾：团雾
-            "LongTail: After Rain" # 长尾：雨后
-        ])
+        # config 字符串作为 userData 挂在每一项上
+        for text, code in WEATHER_CODES.items():
+            self.weather_combo.addItem(text, code)
         
         # 车辆数量 (对应 TrafficManager)
-        self.vehicle_spin = QSpinBox()
-        self.vehicle_spin.setRange(0, 200); self.vehicle_spin.setValue(50)
+        self.vehicle_spin = _spin(0, 200, 50)
         
         # 行人数量 (对应 TrafficManager)
-        self.walker_spin = QSpinBox()
-        self.walker_spin.setRange(0, 200); self.walker_spin.setValue(20)
+        self.walker_spin = _spin(0, 200, 20)
         
         # 障碍物数量 (对应 SceneManager)
-        self.props_spin = QSpinBox()
-        self.props_spin.setRange(0, 100); self.props_spin.setValue(10)
+        self.props_spin = _spin(0, 100, 10)
         
         # 布局
-        sim_layout.addWidget(QLabel("Weather:"), 0, 0)
-        sim_layout.addWidget(self.weather_combo, 0, 1)
-        
-        sim_layout.addWidget(QLabel("Vehicles:"), 1, 0)
-        sim_layout.addWidget(self.vehicle_spin, 1, 1)
-        
-        sim_layout.addWidget(QLabel("Walkers:"), 2, 0)
-        sim_layout.addWidget(self.walker_spin, 2, 1)
-
-        sim_layout.addWidget(QLabel("Obstacles:"), 3, 0)
-        sim_layout.addWidget(self.props_spin, 3, 1)
+        self._row(sim_layout, 0, "Weather:", self.weather_combo)
+        self._row(sim_layout, 1, "Vehicles:", self.vehicle_spin)
+        self._row(sim_layout, 2, "Walkers:", self.walker_spin)
+        self._row(sim_layout, 3, "Obstacles:", self.props_spin)
         
         sim_group.setLayout(sim_layout)
         left_panel.addWidget(sim_group)
@@ -130,9 +160,7 @@ class MainWindow(QMainWindow):
         # 4. Capture Params
         cap_group = QGroupBox("Capture Params")
         cap_layout = QHBoxLayout()
-        self.frames_spin = QSpinBox()
-        self.frames_spin.setRange(100, 100000)
-        self.frames_spin.setValue(3000)
+        self.frames_spin = _spin(100, 100000, 3000)
         self.frames_spin.setSingleStep(100)
         self.frames_spin.setSuffix(" frames")
         cap_layout.addWidget(QLabel("Target:"))
@@ -162,22 +190,29 @@ class MainWindow(QMainWindow):
         right_panel = QVBoxLayout()
         
         # 视频区域
-        self.image_label = QLabel("Waiting for CARLA stream...")
+        self.image_label = PreviewLabel("Waiting for CARLA stream...")
         self.image_label.setAlignment(Qt.AlignCenter)
-        self.image_label.setStyleSheet("background-color: #000; border: 2px solid #333; border-radius: 4px;")
+        self.image_label.setObjectName("videoLabel")
         self.image_label.setMinimumSize(800, 450)
         self.image_label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        # 缓存显示区域尺寸，只在 label 尺寸变化时更新（见 eventFilter）
+        self._label_w, self._label_h = self.image_label.width(), self.image_label.height()
+        self._resize_timer = QTimer(self)
+        self._resize_timer.setSingleShot(True)
+        self._resize_timer.setInterval(100)
+        self._resize_timer.timeout.connect(self._push_preview_size)
+        self.image_label.installEventFilter(self)
         
         # 状态栏
         status_container = QWidget()
-        status_container.setStyleSheet("background-color: #252526; border-radius: 4px;")
+        status_container.setObjectName("statusContainer")
         status_layout = QHBoxLayout(status_container)
         
         self.status_label = QLabel("Status: Idle")
-        self.status_label.setStyleSheet("font-size: 14px; color: #00acc1; font-weight: bold;")
+        self.status_label.setObjectName("statusLabel")
         
         self.percent_label = QLabel("0%")
-        self.percent_label.setStyleSheet("color: #888;")
+        self.percent_label.setObjectName("percentLabel")
 
         status_layout.addWidget(self.status_label)
         status_layout.addStretch()
@@ -188,10 +223,12 @@ class MainWindow(QMainWindow):
         self.progress_bar.setTextVisible(False)
         self.progress_bar.setFixedHeight(8)
         
-        self.log_text = QTextEdit()
+        self.log_text = QPlainTextEdit()
         self.log_text.setReadOnly(True)
         self.log_text.setMaximumHeight(150)
         self.log_text.setPlaceholderText("System logs will appear here...")
+        self.log_text.setMaximumBlockCount(2000)  # 长时间采集时限制日志行数
+        self.log_text.setUndoRedoEnabled(False)  # 日志不需要撤销栈，避免长时间运行内存增长
 
         right_panel.addWidget(self.image_label, stretch=4)
         right_panel.addWidget(status_container)
@@ -226,17 +263,15 @@ class MainWindow(QMainWindow):
         btn_browse.setFixedWidth(80)
         btn_browse.clicked.connect(self.browse_validation_folder)
         
-        top_layout.addWidget(QLabel("Data Folder:"), 0, 0)
-        top_layout.addWidget(self.val_path_input, 0, 1)
+        self._row(top_layout, 0, "Data Folder:", self.val_path_input)
         top_layout.addWidget(btn_browse, 0, 2)
         
         # 参数
-        self.val_samples = QSpinBox(); self.val_samples.setRange(0, 100000); self.val_samples.setValue(500)
-        self.val_w = QSpinBox(); self.val_w.setRange(0, 4000); self.val_w.setValue(1920)
-        self.val_h = QSpinBox(); self.val_h.setRange(0, 4000); self.val_h.setValue(1280)
+        self.val_samples = _spin(0, 100000, 500)
+        self.val_w = _spin(0, 4000, 1920)
+        self.val_h = _spin(0, 4000, 1280)
         
-        top_layout.addWidget(QLabel("Samples (0=All):"), 1, 0)
-        top_layout.addWidget(self.val_samples, 1, 1)
+        self._row(top_layout, 1, "Samples (0=All):", self.val_samples)
         
         res_layout = QHBoxLayout()
         res_layout.addWidget(QLabel("Resolution W:"))
@@ -246,6 +281,10 @@ class MainWindow(QMainWindow):
         res_layout.addStretch()
         top_layout.addLayout(res_layout, 1, 2)
 
+        # 并行进程数
+        self.val_workers = _spin(1, 256, multiprocessing.cpu_count())
+        self._row(top_layout, 2, "Workers:", self.val_workers)
+
         top_group.setLayout(top_layout)
         layout.addWidget(top_group)
         
@@ -273,38 +312,57 @@ class MainWindow(QMainWindow):
         layout.addWidget(self.val_progress)
         
         layout.addWidget(QLabel("Logs:"))
-        self.val_log = QTextEdit()
+        self.val_log = QPlainTextEdit()
         self.val_log.setReadOnly(True)
+        self.val_log.setMaximumBlockCount(2000)
+        self.val_log.setUndoRedoEnabled(False)
         layout.addWidget(self.val_log)
 
     # ==========================================
     # Logic: Collection
     # ==========================================
     def log(self, msg):
-        self.log_text.append(msg)
-        # 自动滚动到底部
-        self.log_text.verticalScrollBar().setValue(self.log_text.verticalScrollBar().maximum())
+        self._log_buf.append(msg)
+
+    def log_lines(self, lines):
+        self._log_buf.extend(lines)
+
+    def _flush_log(self):
+        targets = [(self.log_text, self._log_buf)]
+        if self._validation_initialized:
+            targets.append((self.val_log, self._val_log_buf))
+        for widget, buf in targets:
+            if not buf:
+                continue
+            widget.appendPlainText("\n".join(buf))
+            buf.clear()
+            # 自动滚动到底部
+            widget.moveCursor(QTextCursor.End)
+
+    def init_collection_worker(self):
+        # 采集线程对象只创建一次，信号也只绑定一次；每次 START 只重新 configure + start
+        self._collecting = False
+        self.collection_worker = CarlaWorker()
+        self.collection_worker.set_preview_size(self._label_w, self._label_h)
+
+        # 信号绑定：发送方都在 worker 线程，显式指定排队连接
+        self.collection_worker.log_batch_signal.connect(self.log_lines, Qt.QueuedConnection)
+        self.collection_worker.progress_signal.connect(self.update_progress, Qt.QueuedConnection)
+        self.collection_worker.status_signal.connect(self.status_label.setText, Qt.QueuedConnection)
+        # 用 QThread 自带的 finished：它在 run() 返回后才发出，此时线程已结束，重新 START 可以正常 start()
+        self.collection_worker.finished.connect(self.on_collection_finished, Qt.QueuedConnection)
+
+    def _update_start_enabled(self):
+        self.start_btn.setEnabled(not self._collecting and self.port_input.hasAcceptableInput())
 
     def start_collection(self):
-        # 1. 获取基础参数
-        try:
-            frames_val = self.frames_spin.value()
-            port_val = int(self.port_input.text())
-        except ValueError:
-            QMessageBox.warning(self, "Error", "Invalid Port Number!")
-            return
+        # 1. 获取基础参数 (端口已由 QIntValidator 校验，START 只在输入合法时可点)
+        frames_val = self.frames_spin.value()
+        port_val = int(self.port_input.text())
 
         # 2. 获取新的仿真参数
-        weather_mode = self.weather_combo.currentText()
-        # 简单映射一下 ComboBox 文本到 config 字符串 (方便后端处理)
-        if "Random" in weather_mode: w_val = "random"
-        elif "Clear" in weather_mode: w_val = "clear"
-        elif "Overcast" in weather_mode: w_val = "overcast"
-        elif "Rain" in weather_mode: w_val = "rain"
-        elif "Glare" in weather_mode: w_val = "longtail_glare"
-        elif "Fog" in weather_mode: w_val = "longtail_fog"
-        elif "After Rain" in weather_mode: w_val = "longtail_storm"
-        else: w_val = "random"
+        # ComboBox 每项的 userData 就是 config 字符串 (方便后端处理)
+        w_val = self.weather_combo.currentData() or "random"
 
         config = {
             'host': self.ip_input.text(),
@@ -327,15 +385,17 @@ class MainWindow(QMainWindow):
             'min_dist': 3.0
         }
         
-        self.collection_worker = CarlaWorker(config)
-        
-        # 信号绑定
-        self.collection_worker.log_signal.connect(self.log)
-        self.collection_worker.image_signal.connect(self.update_image)
-        self.collection_worker.progress_signal.connect(self.update_progress)
-        self.collection_worker.status_signal.connect(self.status_label.setText)
-        self.collection_worker.finished_signal.connect(self.on_collection_finished)
-        
+        if self._collecting:
+            return
+        if self.collection_worker.isRunning():
+            # 兜底：上一次的 run() 刚返回、线程还在收尾，等它真正结束再重启
+            self.collection_worker.wait()
+        try:
+            self.collection_worker.configure(config)
+        except ValueError as e:
+            QMessageBox.warning(self, "Error", str(e))
+            return
+        self._collecting = True
         self.collection_worker.start()
         
         # UI 状态更新
@@ -350,48 +410,66 @@ class MainWindow(QMainWindow):
         self.percent_label.setText(f"{val}%")
 
     def stop_collection(self):
-        if self.collection_worker:
+        if self._collecting:
             self.collection_worker.stop()
             self.log("Stopping...")
 
     def on_collection_finished(self):
-        self.start_btn.setEnabled(True)
+        self._collecting = False
+        self._update_start_enabled()
         self.stop_btn.setEnabled(False)
-        self.collection_worker = None
         self.status_label.setText("Status: Idle")
         self.log("Collection thread exited.")
 
-    @pyqtSlot(np.ndarray)
+    def eventFilter(self, obj, event):
+        if obj is self.image_label and event.type() == QEvent.Resize:
+            self._label_w, self._label_h = event.size().width(), event.size().height()
+            # 拖动窗口时会连续触发 resize，停下 100ms 后才通知 worker 新尺寸
+            self._resize_timer.start()
+        return super().eventFilter(obj, event)
+
+    def _push_preview_size(self):
+        if self.collection_worker is not None:
+            self.collection_worker.set_preview_size(self._label_w, self._label_h)
+
+    def _flush_frame(self):
+        # 从 worker 的"最新帧"信箱里取帧（取走即清空），没有新帧就什么都不做
+        if self.collection_worker is None or self.tabs.currentWidget() is not self.tab_collection:
+            return
+        cv_img = self.collection_worker.take_latest_frame()
+        if cv_img is not None:
+            self.update_image(cv_img)
+
     def update_image(self, cv_img):
-        try:
-            h, w, ch = cv_img.shape
-            bytes_per_line = ch * w
-            qt_img = QImage(cv_img.data, w, h, bytes_per_line, QImage.Format_RGB888)
-            # 保持比例缩放
-            pixmap = QPixmap.fromImage(qt_img).scaled(
-                self.image_label.width(), 
-                self.image_label.height(), 
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation
-            )
-            self.image_label.setPixmap(pixmap)
-        except Exception:
-            pass
+        # QImage 直接引用 ndarray 的内存（不拷贝），预览控件持有 ndarray 引用保证绘制前不被回收；
+        # worker 保证发来的数组拥有自己的内存 (缩放结果或拷贝)
+        # worker 发来的是 BGRA：小端机器上正好是 Format_RGB32 (0xffRRGGBB) 的内存布局，
+        # 每行 4*w 字节天然 32 位对齐，Qt 不需要再逐行重排拷贝。格式不符时报错并丢帧，不静默吞掉
+        if (cv_img.ndim != 3 or cv_img.shape[2] != 4 or cv_img.dtype != np.uint8
+                or not cv_img.flags['C_CONTIGUOUS']):
+            if not self._bad_frame_logged:
+                self._bad_frame_logged = True
+                self.log(f"ERROR: preview frame must be C-contiguous uint8 BGRA, "
+                         f"got shape={cv_img.shape} dtype={cv_img.dtype} strides={cv_img.strides}")
+            return
+        h, w = cv_img.shape[:2]
+        qt_img = QImage(cv_img.data, w, h, cv_img.strides[0], self._fmt)
+        # 预览控件在 paintEvent 里直接 drawImage，不再转 QPixmap；尺寸不符时绘制时顺带缩放
+        self.image_label.set_frame(qt_img, cv_img)
 
     # ==========================================
     # Logic: Validation
     # ==========================================
     def browse_validation_folder(self):
-        options = QFileDialog.Options()
-        options |= QFileDialog.DontUseNativeDialog
-        options |= QFileDialog.ShowDirsOnly
-        d = QFileDialog.getExistingDirectory(self, "Select JSON Folder", ".", options=options)
+        # 使用系统原生对话框，并从上次选过的目录打开
+        d = QFileDialog.getExistingDirectory(self, "Select JSON Folder", self._last_browse_dir,
+                                             QFileDialog.ShowDirsOnly)
         if d:
+            self._last_browse_dir = d
             self.val_path_input.setText(d)
 
     def log_val(self, msg):
-        self.val_log.append(msg)
-        self.val_log.verticalScrollBar().setValue(self.val_log.verticalScrollBar().maximum())
+        self._val_log_buf.append(msg)
 
     def start_validation(self):
         path = self.val_path_input.text().strip()
@@ -406,15 +484,17 @@ class MainWindow(QMainWindow):
             num_samples=self.val_samples.value(),
             img_w=self.val_w.value(),
             img_h=self.val_h.value(),
-            out_csv=out_csv
+            out_csv=out_csv,
+            n_workers=self.val_workers.value()
         )
-        self.validation_worker.log_signal.connect(self.log_val)
-        self.validation_worker.progress_signal.connect(self.val_progress.setValue)
-        self.validation_worker.finished_signal.connect(self.on_val_finished)
+        self.validation_worker.log_signal.connect(self.log_val, Qt.QueuedConnection)
+        self.validation_worker.progress_signal.connect(self.val_progress.setValue, Qt.QueuedConnection)
+        self.validation_worker.finished_signal.connect(self.on_val_finished, Qt.QueuedConnection)
         
         self.validation_worker.start()
         self.btn_start_val.setEnabled(False)
         self.btn_stop_val.setEnabled(True)
+        self._val_log_buf.clear()
         self.val_log.clear()
         self.log_val(">>> Starting Validation >>>")
 
@@ -0,0 +1,47 @@
+# gui/preview_label.py
+from PyQt5.QtCore import QPoint, QRect
+from PyQt5.QtWidgets import QLabel
+from PyQt5.QtGui import QPainter
+
+
+class PreviewLabel(QLabel):
+    """
+    视频预览区域：直接在 paintEvent 里 drawImage 画当前帧，
+    不再每帧做 QImage -> QPixmap 转换，也不生成缩放后的副本
+    """
+    def __init__(self, text=""):
+        super().__init__(text)
+        self._frame_img = None   # 当前帧 QImage (引用 ndarray 内存)
+        self._frame_ref = None   # 持有 ndarray 引用，保证绘制前不被回收
+                                 # (只对 ndarray 自己拥有的内存有效，不能是 carla raw_data 视图)
+
+    def set_frame(self, qimg, owner):
+        if self._frame_img is None:
+            self.setText("")  # 第一帧到来时去掉占位文字
+        self._frame_img = qimg
+        self._frame_ref = owner
+        self.update()
+
+    def paintEvent(self, event):
+        # 先让 QLabel 按样式表画背景/边框
+        super().paintEvent(event)
+        img = self._frame_img
+        if img is None:
+            return
+
+        # 等比放进内容区域并居中 (和原来的 KeepAspectRatio 一样，区域比帧大时也放大)；
+        # 尺寸不一致时由 drawImage 直接做缩放
+        area = self.contentsRect()
+        w, h = img.width(), img.height()
+        scale = min(area.width() / w, area.height() / h)
+        dw, dh = int(w * scale), int(h * scale)
+        x = area.x() + (area.width() - dw) // 2
+        y = area.y() + (area.height() - dh) // 2
+
+        painter = QPainter(self)
+        if dw == w and dh == h:
+            # 常见情况：worker 已按预览尺寸缩好，直接 1:1 拷贝，不走缩放路径
+            painter.drawImage(QPoint(x, y), img)
+        else:
+            painter.drawImage(QRect(x, y, dw, dh), img)
+        painter.end()
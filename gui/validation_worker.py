@@ -1,32 +1,48 @@
 # gui/validation_worker.py
 import os
-import glob
-import math
 import random
+import time
 import traceback
+import multiprocessing
 import numpy as np
 from PyQt5.QtCore import QThread, pyqtSignal
 
 # 引入验证脚本中的核心逻辑
 # 确保你已经在 tools/ 下创建了 __init__.py
 try:
-    from tools.batch_validate_openlane import validate_frame, FrameReport, load_frame, write_csv
+    from tools.batch_validate_openlane import validate_frame, FrameReport, iter_frames, write_csv
 except ImportError:
     # 备用方案：如果导入失败，提示用户检查路径
     print("Error: Could not import tools.batch_validate_openlane. Please ensure 'tools/__init__.py' exists.")
 
+def _validate_one(args):
+    """
+    进程池任务：读取并验证单个文件 (jsonl 一次读入、逐行验证)，
+    返回 [(name, report, error), ...]
+    """
+    p, img_w, img_h = args
+    out = []
+    try:
+        for name, frame in iter_frames(p):
+            out.append((name, validate_frame(frame, name, img_w, img_h), None))
+    except Exception as e:
+        out.append((p, None, str(e)))
+    return out
+
+
 class ValidationWorker(QThread):
     log_signal = pyqtSignal(str)          # 发送日志文本
     progress_signal = pyqtSignal(int)     # 发送进度 (0-100)
     finished_signal = pyqtSignal(str)     # 完成信号(返回摘要信息)
     
-    def __init__(self, input_dir, num_samples, img_w, img_h, out_csv):
+    def __init__(self, input_dir, num_samples, img_w, img_h, out_csv, n_workers=1):
         super().__init__()
         self.input_dir = input_dir
         self.num_samples = num_samples
         self.img_w = img_w
         self.img_h = img_h
         self.out_csv = out_csv
+        self.n_workers = max(1, int(n_workers))
         self.is_running = True
 
     def stop(self):
@@ -36,12 +52,16 @@ class ValidationWorker(QThread):
         try:
             self.log_signal.emit(f"Scanning directory: {self.input_dir}")
             
-            # 1. 查找文件
-            pattern = os.path.join(self.input_dir, "*.json")
-            files = sorted(glob.glob(pattern))
-            if not files:
-                # 尝试 jsonl
-                files = sorted(glob.glob(os.path.join(self.input_dir, "*.jsonl")))
+            # 1. 查找文件 (一次 scandir 同时收集 json / jsonl，没有 json 时才用 jsonl)
+            json_files, jsonl_files = [], []
+            with os.scandir(self.input_dir) as it:
+                for e in it:
+                    if e.name.endswith(".json"):
+                        json_files.append(e.path)
+                    elif e.name.endswith(".jsonl"):
+                        jsonl_files.append(e.path)
+            # 排序保证固定种子下采样结果可复现 (scandir 顺序不固定)
+            files = sorted(json_files or jsonl_files)
             
             if not files:
                 self.log_signal.emit("❌ No JSON/JSONL files found!")
@@ -60,35 +80,59 @@ class ValidationWorker(QThread):
             reports = []
             total = len(files)
             
-            for i, p in enumerate(files):
-                if not self.is_running:
-                    self.log_signal.emit("Validation stopped by user.")
-                    break
-                
-                try:
-                    frame = load_frame(p)
-                    # 调用原始脚本的验证函数
-                    rep = validate_frame(frame, p, self.img_w, self.img_h)
-                    reports.append(rep)
-                    
-                    if not rep.ok:
-                        short_name = os.path.basename(p)
-                        self.log_signal.emit(f"⚠️ Fail [{short_name}]: {rep.reason}")
-                
-                except Exception as e:
-                    self.log_signal.emit(f"Error reading {os.path.basename(p)}: {e}")
+            tasks = [(p, self.img_w, self.img_h) for p in files]
+            basenames = [os.path.basename(p) for p in files]  # 日志里只用文件名，提前算好
+            last_emit = 0.0
+            fail_buf = []  # 失败/错误信息先攒起来，和进度一起成批发送
+
+            # 多进程时用 imap 保持原有顺序，文件多时按块分发减少进程间通信
+            pool = None
+            if self.n_workers > 1 and total > 1:
+                pool = multiprocessing.Pool(min(self.n_workers, total))
+                chunksize = max(1, total // (self.n_workers * 8))
+                results = pool.imap(_validate_one, tasks, chunksize)
+            else:
+                results = map(_validate_one, tasks)
+
+            try:
+                for i, items in enumerate(results):
+                    if not self.is_running:
+                        fail_buf.append("Validation stopped by user.")
+                        break
+
+                    plen = len(files[i])
+                    for name, rep, err in items:
+                        # name 是文件路径，jsonl 的帧再加 ":行号" 后缀
+                        label = basenames[i] + name[plen:]
+                        if err is not None:
+                            fail_buf.append(f"Error reading {label}: {err}")
+                        else:
+                            reports.append(rep)
+                            if not rep.ok:
+                                fail_buf.append(f"⚠️ Fail [{label}]: {rep.reason}")
 
-                # 更新进度
-                if i % 10 == 0 or i == total - 1:
-                    progress = int((i + 1) / total * 100)
-                    self.progress_signal.emit(progress)
+                    # 更新进度和日志 (限制在 ~30Hz 以内，不按文件数刷屏)
+                    now = time.monotonic()
+                    if now - last_emit >= 0.033 or i == total - 1 or len(fail_buf) >= 64:
+                        last_emit = now
+                        self.progress_signal.emit(int((i + 1) / total * 100))
+                        if fail_buf:
+                            self.log_signal.emit("\n".join(fail_buf))
+                            fail_buf.clear()
+            finally:
+                if fail_buf:
+                    self.log_signal.emit("\n".join(fail_buf))
+                if pool is not None:
+                    pool.terminate()
+                    pool.join()
 
             # 4. 生成统计摘要
             if reports:
                 ok_count = sum(1 for r in reports if r.ok)
                 fail_count = len(reports) - ok_count
                 
-                reproj_means = np.array([r.reproj_mean_px for r in reports if not math.isnan(r.reproj_mean_px)])
+                reproj_means = np.fromiter((r.reproj_mean_px for r in reports), dtype=np.float64, count=len(reports))
+                reproj_means = reproj_means[~np.isnan(reproj_means)]
                 
                 summary = []
                 summary.append("========== Validation Summary ==========")
@@ -1,54 +1,119 @@
 # gui/worker.py
 import time
 import os
-import json
+import math
+import random
 import cv2
 import numpy as np
 import carla
 import traceback
+from types import MappingProxyType
 
-from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtCore import QThread, QMutex, pyqtSignal
 
 # 引入你项目中的模块
 from simulation.sensor_manager import SyncSensorManager
 # from simulation.traffic_manager import NPCManager # 如果你暂时没用到 NPCManager，可以先注释掉
 from core.generator import OpenLaneGenerator
 from core.geometry import GeometryUtils
+from core.io_handler import AsyncFrameWriter
+
+# 天气选项: 显示文本 -> 传给后端的 config 字符串，对应 weather_manager.py 的逻辑
+# UI 下拉框和 worker 的参数校验共用这一份表
+WEATHER_CODES = MappingProxyType({
+    "Random (Default)": "random",              # 随机
+    "Clear Noon": "clear",                     # 晴天
+    "Overcast": "overcast",                    # 阴天
+    "Rain": "rain",                            # 下雨
+    "LongTail: Glare": "longtail_glare",       # 长尾：眩光
+    "LongTail: Heavy Fog": "longtail_fog",     # 长尾：团雾
+    "LongTail: After Rain": "longtail_storm",  # 长尾：雨后
+})
+_VALID_WEATHER = frozenset(WEATHER_CODES.values())
 
 class CarlaWorker(QThread):
     # 定义信号：发送给 UI 线程的数据
-    log_signal = pyqtSignal(str)          # 发送日志文本
-    image_signal = pyqtSignal(np.ndarray) # 发送 OpenCV 图片
+    log_batch_signal = pyqtSignal(list)   # 发送一批日志文本 (合并发送，减少跨线程事件)
     progress_signal = pyqtSignal(int)     # 发送进度 (0-100)
     status_signal = pyqtSignal(str)       # 简短状态 (如 "Speed: 30km/h")
-    finished_signal = pyqtSignal()        # 任务结束
+    # 任务结束由 QThread 自带的 finished 信号通知 (run() 真正返回之后才发)
 
-    def __init__(self, config):
+    def __init__(self, config=None):
         super().__init__()
         self.cfg = config
-        self.is_running = True
+        self.is_running = False
         self.client = None
         self.world = None
+        self._preview_size = None  # (w, h) UI 预览区域大小，由 UI 线程设置
+
+        # 日志缓冲：连续的日志合并成一批再发给 UI
+        self._log_buf = []
+        self._last_log_emit = 0.0
+
+        # 预览帧信箱：只保存最新一帧，UI 定时器来取（不走信号队列，避免积压）
+        self._frame_mutex = QMutex()
+        self._latest_frame = None
         
+    def configure(self, config):
+        """每次开始采集前调用（线程未运行时），worker 对象本身在多次采集间复用"""
+        if config.get('weather_mode', 'random') not in _VALID_WEATHER:
+            raise ValueError(f"Unknown weather_mode: {config['weather_mode']}")
+        self.cfg = config
+        self.is_running = True
+        self.take_latest_frame()  # 丢掉上一轮残留的预览帧
+
     def stop(self):
         """外部调用此方法请求停止"""
         self.is_running = False
 
+    def _log(self, msg):
+        """worker 线程内记录日志；距上次发送超过 100ms 才真正发一批"""
+        self._log_buf.append(msg)
+        if time.monotonic() - self._last_log_emit >= 0.1:
+            self._flush_logs()
+
+    def _flush_logs(self):
+        if self._log_buf:
+            self.log_batch_signal.emit(self._log_buf)
+            self._log_buf = []
+            self._last_log_emit = time.monotonic()
+
+    def set_latest_frame(self, frame):
+        """worker 线程调用：覆盖写最新预览帧"""
+        self._frame_mutex.lock()
+        try:
+            self._latest_frame = frame
+        finally:
+            self._frame_mutex.unlock()
+
+    def take_latest_frame(self):
+        """UI 线程调用：取走最新预览帧（没有新帧返回 None）"""
+        self._frame_mutex.lock()
+        try:
+            frame, self._latest_frame = self._latest_frame, None
+        finally:
+            self._frame_mutex.unlock()
+        return frame
+
+    def set_preview_size(self, w, h):
+        """UI 预览区域尺寸变化时调用，worker 按此尺寸预先缩小预览帧"""
+        self._preview_size = (int(w), int(h))
+
     def run(self):
         """线程入口"""
         try:
-            self.log_signal.emit(f"Connecting to CARLA at {self.cfg['host']}:{self.cfg['port']}...")
+            self._log(f"Connecting to CARLA at {self.cfg['host']}:{self.cfg['port']}...")
             
             client = carla.Client(self.cfg['host'], self.cfg['port'])
             client.set_timeout(20.0)
 
             # 1. 加载地图
-            curr_map = client.get_world().get_map().name.split('/')[-1]
-            if curr_map != self.cfg['town']:
-                self.log_signal.emit(f"Loading map: {self.cfg['town']}...")
+            world = client.get_world()
+            carla_map = world.get_map()
+            if carla_map.name.split('/')[-1] != self.cfg['town']:
+                self._log(f"Loading map: {self.cfg['town']}...")
                 world = client.load_world(self.cfg['town'])
-            else:
-                world = client.get_world()
+                carla_map = world.get_map()
 
             # 2. 设置同步模式 (必须)
             settings = world.get_settings()
@@ -66,11 +131,10 @@ class CarlaWorker(QThread):
             vehicle_bp = bp_lib.find('vehicle.tesla.model3')
             vehicle_bp.set_attribute('role_name', 'hero')
             
-            spawn_points = world.get_map().get_spawn_points()
+            spawn_points = carla_map.get_spawn_points()
             ego_vehicle = None
             
             # 简单的寻找出生点逻辑
-            import random
             random.shuffle(spawn_points) # 随机打乱，防止每次都在同一个点
             
             for sp in spawn_points:
@@ -96,7 +160,7 @@ class CarlaWorker(QThread):
             
             # 初始化生成器
             K = GeometryUtils.build_projection_matrix(W, H, FOV)
-            generator = OpenLaneGenerator(world, camera_k=K)
+            generator = OpenLaneGenerator(world, camera_k=K, carla_map=carla_map)
 
             # 5. 准备保存目录
             output_dir = "data/OpenLane"
@@ -104,8 +168,13 @@ class CarlaWorker(QThread):
             json_dir = os.path.join(output_dir, "lane3d_1000", self.cfg['split'], self.cfg['segment'])
             os.makedirs(img_dir, exist_ok=True)
             os.makedirs(json_dir, exist_ok=True)
+            # 保存路径模板只拼一次，循环里用 % 填帧号 (目录名里的 % 先转义)
+            img_tmpl = os.path.join(img_dir.replace('%', '%%'), "%06d.jpg")
+            json_tmpl = os.path.join(json_dir.replace('%', '%%'), "%06d.json")
+            rel_tmpl = f"{self.cfg['split']}/{self.cfg['segment']}/".replace('%', '%%') + "%06d.jpg"
+            writer = AsyncFrameWriter()  # 图片/json 交给后台线程写盘
 
-            self.log_signal.emit("Warming up simulation...")
+            self._log("Warming up simulation...")
             for _ in range(20): 
                 world.tick()
 
@@ -113,10 +182,20 @@ class CarlaWorker(QThread):
             last_save_loc = None
             target_frames = self.cfg['frames']
 
-            self.log_signal.emit(">>> Start Recording <<<")
+            self._log(">>> Start Recording <<<")
 
             # === 主循环 ===
+            last_status_emit = 0.0
+            min_speed_sq = (self.cfg['min_speed'] / 3.6) ** 2  # min_speed 单位 km/h
+            last_preview_t = 0.0
+            last_progress = -1
+            zero_lane_streak = 0          # 连续无车道线的帧数
+            last_try_loc = None           # 上一次做 process_frame 的位置
+            backoff_dist = self.cfg['min_dist']
             while self.is_running and frame_count < target_frames:
+                # 只把攒了超过 100ms 的日志发出去；每圈都 flush 的话一批只有一行，合并就失效了
+                if self._log_buf and time.monotonic() - self._last_log_emit >= 0.1:
+                    self._flush_logs()
                 # [关键修复] 获取 frame_id
                 frame_id = world.tick()
 
@@ -124,60 +203,107 @@ class CarlaWorker(QThread):
                 rgb, depth, seg, tf = sensor_mgr.get_synced_frames(frame_id, timeout=2.0)
                 
                 if rgb is None: 
-                    # self.log_signal.emit("Frame Drop or Timeout")
+                    # self._log("Frame Drop or Timeout")
                     continue
                 
-                # 处理图像显示
-                img_bgra = np.frombuffer(rgb.raw_data, dtype=np.uint8).reshape(H, W, 4)
-                img_bgr = img_bgra[:, :, :3]
-                img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-                self.image_signal.emit(img_rgb) # 发送给 UI 显示
+                # 先取车辆状态，图像等真正需要时再处理。
+                # 从本次 tick 的 WorldSnapshot 里一次性拿位姿和速度，保证和这帧图像同一时刻
+                ego_snap = world.get_snapshot().find(ego_vehicle.id)
+                if ego_snap is not None:
+                    loc = ego_snap.get_transform().location
+                    v = ego_snap.get_velocity()
+                else:
+                    loc = ego_vehicle.get_location()
+                    v = ego_vehicle.get_velocity()
+                vx, vy, vz = v.x, v.y, v.z
+                speed_sq = vx*vx + vy*vy + vz*vz  # (m/s)^2，过滤时直接比平方，不开方
+                now = time.monotonic()
+
+                # 处理图像显示 (预览限制在 UI 刷新率 ~30Hz，多余的帧反正也会被 UI 丢弃)
+                img_bgra = None
+                if now - last_preview_t >= 0.033:
+                    last_preview_t = now
+                    img_bgra = np.frombuffer(rgb.raw_data, dtype=np.uint8).reshape(H, W, 4)
+                    preview = img_bgra
+                    if self._preview_size is not None:
+                        # 在 worker 线程里按预览区域等比缩小 (INTER_AREA)，UI 线程不再做平滑缩放
+                        pw, ph = self._preview_size
+                        scale = min(pw / W, ph / H)
+                        if 0 < scale < 1:
+                            size = (max(1, int(W * scale)), max(1, int(H * scale)))
+                            preview = cv2.resize(img_bgra, size, interpolation=cv2.INTER_AREA)
+                    # 直接发 BGRA（4 字节/像素，行天然 4 字节对齐），UI 端按 Format_RGB32 解释，
+                    # 不再做 BGR->RGB 转换；QImage 直接引用这块内存，必须是 C 连续的 uint8。
+                    # 发给 UI 的数组必须自己拥有内存：raw_data 视图不持有 carla.Image，buffer 会被回收复用，
+                    # 没缩放时 (preview 仍是 img_bgra) 拷贝一份
+                    if preview is img_bgra:
+                        preview = img_bgra.copy()
+                    self.set_latest_frame(preview) # 交给 UI 显示
 
                 # 状态更新
-                loc = ego_vehicle.get_location()
-                v = ego_vehicle.get_velocity()
-                speed = 3.6 * (v.x**2 + v.y**2 + v.z**2)**0.5 # km/h
-                self.status_signal.emit(f"Speed: {speed:.1f} km/h | Frames: {frame_count}/{target_frames}")
+                if now - last_status_emit >= 0.1:  # 状态栏限制在 ~10Hz
+                    last_status_emit = now
+                    speed = 3.6 * math.sqrt(speed_sq) # km/h
+                    self.status_signal.emit(f"Speed: {speed:.1f} km/h | Frames: {frame_count}/{target_frames}")
 
                 # 过滤逻辑 (停车时不保存)
-                if speed < self.cfg['min_speed']: continue
+                if speed_sq < min_speed_sq: continue
                 if last_save_loc and loc.distance(last_save_loc) < self.cfg['min_dist']: continue
+                # 连续多帧没有车道线 (路口/停车场等)：拉大生成间隔，少做无用的 process_frame
+                if zero_lane_streak >= 5 and loc.distance(last_try_loc) < backoff_dist: continue
 
                 # 生成 OpenLane 数据
                 result = generator.process_frame(ego_vehicle, tf, seg_image=seg)
                 lane_count = len(result['lane_lines'])
 
+                if lane_count == 0:
+                    zero_lane_streak += 1
+                    last_try_loc = loc
+                    if zero_lane_streak >= 5:
+                        backoff_dist = min(backoff_dist * 1.5, 50.0)
+                else:
+                    zero_lane_streak = 0
+                    backoff_dist = self.cfg['min_dist']
+
                 if lane_count > 0:
-                    file_id = f"{frame_count:06d}"
-                    
-                    # 保存图片 (OpenCV 使用 BGR)
-                    cv2.imwrite(os.path.join(img_dir, f"{file_id}.jpg"), img_bgr)
-                    
-                    # 保存 JSON
-                    result["file_path"] = f"{self.cfg['split']}/{self.cfg['segment']}/{file_id}.jpg"
-                    with open(os.path.join(json_dir, f"{file_id}.json"), 'w') as f:
-                        json.dump(result, f)
+                    # 保存图片 + JSON (交给后台写盘线程)
+                    # JPEG 编码器会自己丢掉 alpha 通道，直接写 BGRA，省掉去 alpha 的非连续视图拷贝。
+                    # raw_data 的 memoryview 不持有 carla.Image，传感器 buffer 会被回收复用，
+                    # 写盘线程晚于下一次 tick 才编码，所以入队前必须拷贝一份
+                    if img_bgra is None:
+                        img_bgra = np.frombuffer(rgb.raw_data, dtype=np.uint8).reshape(H, W, 4)
+
+                    result["file_path"] = rel_tmpl % frame_count
+                    writer.put(img_tmpl % frame_count, img_bgra.copy(), json_tmpl % frame_count, result)
 
                     frame_count += 1
                     last_save_loc = loc
                     
                     # 更新进度
                     progress = int((frame_count / target_frames) * 100)
-                    self.progress_signal.emit(progress)
+                    if progress != last_progress:  # 百分比变化时才发，整个采集最多 ~100 次
+                        last_progress = progress
+                        self.progress_signal.emit(progress)
                     if frame_count % 10 == 0:
-                        self.log_signal.emit(f"Saved {file_id} | Lanes: {lane_count}")
+                        self._log(f"Saved {frame_count - 1:06d} | Lanes: {lane_count}")
 
-            self.log_signal.emit("Collection Finished.")
+            writer.close()
+            self._log("Collection Finished.")
 
         except Exception as e:
-            self.log_signal.emit(f"ERROR: {str(e)}")
+            self._log(f"ERROR: {str(e)}")
             traceback.print_exc()
         finally:
             # 清理资源
-            self.log_signal.emit("Cleaning up actors...")
+            self._log("Cleaning up actors...")
+            if 'writer' in locals():
+                try:
+                    writer.close()  # 出错退出时也要把已入队的帧写完
+                except Exception as e:
+                    self._log(f"ERROR: {str(e)}")
             if 'settings' in locals():
                 settings.synchronous_mode = False
                 world.apply_settings(settings)
             if 'sensor_mgr' in locals() and sensor_mgr: sensor_mgr.destroy()
             if 'ego_vehicle' in locals() and ego_vehicle: ego_vehicle.destroy()
-            self.finished_signal.emit()
\ No newline at end of file
+            self._flush_logs()
\ No newline at end of file
@@ -2,9 +2,11 @@
 import sys
 from PyQt5.QtWidgets import QApplication
 from gui.app_window import MainWindow
+from gui.styles import apply_theme
 
 def main():
     app = QApplication(sys.argv)
+    apply_theme(app)  # 全局样式表只在 QApplication 上设置一次
     window = MainWindow()
     window.show()
     sys.exit(app.exec_())
@@ -1,17 +1,16 @@
 import carla
 import argparse
 import os
-import json
-import cv2
 import numpy as np
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor
 from simulation.sensor_manager import SyncSensorManager
 from simulation.traffic_manager import NPCManager
 from core.generator import OpenLaneGenerator
 from core.geometry import GeometryUtils
+from core.io_handler import AsyncFrameWriter, TarShardWriter, scan_tar_shards
 #[新增]
-import glob
 from simulation.weather_manager import WeatherManager
 from simulation.scene_manager import SceneManager
 from utils import map_utils 
@@ -23,26 +22,27 @@ def _get_existing_progress(img_dir, json_dir):
     """
     if not os.path.exists(img_dir) or not os.path.exists(json_dir):
         return 0
-    jpgs = glob.glob(os.path.join(img_dir, "*.jpg"))
-    jsons = glob.glob(os.path.join(json_dir, "*.json"))
-    
-    if not jpgs or not jsons:
-        return 0
-        
-    # 取两者都有的交集，防止存了一半崩溃
-    jpg_ids = {os.path.splitext(os.path.basename(f))[0] for f in jpgs}
-    json_ids = {os.path.splitext(os.path.basename(f))[0] for f in jsons}
-    valid_ids = jpg_ids.intersection(json_ids)
-    
-    if not valid_ids:
-        return 0
-        
-    # 找到目前最大的ID，下一帧就是 max + 1
-    try:
-        max_id = max([int(fid) for fid in valid_ids])
-        return max_id + 1
-    except ValueError:
-        return len(valid_ids)
+
+    # 每个目录只 scandir 一遍，文件名在插入时就转成 int
+    jpg_ids = set()
+    with os.scandir(img_dir) as it:
+        for e in it:
+            name = e.name
+            if name.endswith(".jpg") and name[:-4].isdigit():
+                jpg_ids.add(int(name[:-4]))
+
+    # 取两者都有的交集，防止存了一半崩溃；边扫 json 边记最大 ID
+    max_id = -1
+    with os.scandir(json_dir) as it:
+        for e in it:
+            name = e.name
+            if name.endswith(".json") and name[:-5].isdigit():
+                fid = int(name[:-5])
+                if fid > max_id and fid in jpg_ids:
+                    max_id = fid
+
+    # 下一帧就是 max + 1 (没有有效帧时为 0)
+    return max_id + 1
 
 def _ensure_world(client, target_town: str, fixed_delta=0.1):
     """
@@ -66,7 +66,7 @@ def _ensure_world(client, target_town: str, fixed_delta=0.1):
     return world
 
 
-def _spawn_ego(world, tm, rng: random.Random):
+def _spawn_ego(world, tm, rng: random.Random, carla_map=None):
     """
     生成 Ego 车辆
     """
@@ -74,13 +74,15 @@ def _spawn_ego(world, tm, rng: random.Random):
     vehicle_bp = bp_lib.find('vehicle.tesla.model3')
     vehicle_bp.set_attribute('role_name', 'hero')
 
-    spawn_points = world.get_map().get_spawn_points()
+    if carla_map is None:
+        carla_map = world.get_map()  # get_map() 是一次 RPC (含 OpenDRIVE)，只取一次
+    spawn_points = carla_map.get_spawn_points()
     rng.shuffle(spawn_points)
 
     ego_vehicle = None
     # 尝试在车道上生成
     for sp in spawn_points:
-        wp = world.get_map().get_waypoint(sp.location, project_to_road=True)
+        wp = carla_map.get_waypoint(sp.location, project_to_road=True)
         if wp is None or wp.lane_type != carla.LaneType.Driving:
             continue
         ego_vehicle = world.try_spawn_actor(vehicle_bp, sp)
@@ -122,6 +124,9 @@ def main():
     argparser.add_argument('--episodes', default=1, type=int)
     argparser.add_argument('--frames_per_episode', default=1000, type=int)
     argparser.add_argument('--episode_start', default=0, type=int)
+    # 打包成 WebDataset 风格的 tar 分片 (默认仍按 OpenLane 目录结构逐文件写)
+    argparser.add_argument('--tar_shards', action='store_true', help='Write samples into rolling tar shards')
+    argparser.add_argument('--shard_size', default=1000, type=int, help='Samples per tar shard')
     
     # 兼容旧参数
     argparser.add_argument('--frames', default=None, type=int) 
@@ -152,6 +157,9 @@ def main():
     ego_vehicle = None
     tm = None
     world = None
+    writer = None
+    # 真值生成单独一个线程，和下一帧的 world.tick() 重叠
+    frame_exe = ThreadPoolExecutor(max_workers=1)
 
     try:
         # 兼容逻辑
@@ -215,9 +223,13 @@ def main():
             split_name = args.split
             img_dir = os.path.join(output_dir, "images", split_name, segment_name)
             json_dir = os.path.join(output_dir, "lane3d_1000", split_name, segment_name)
+            shard_dir = os.path.join(output_dir, "shards", split_name)
 
             # [关键修改 4] 检查进度 (Check Point)
-            start_frame = _get_existing_progress(img_dir, json_dir)
+            if args.tar_shards:
+                start_frame, next_shard = scan_tar_shards(shard_dir, segment_name)
+            else:
+                start_frame = _get_existing_progress(img_dir, json_dir)
             
             if start_frame >= args.frames_per_episode:
                 print(f"✅ [Episode {epi}] Segment {segment_name} 已完成 ({start_frame} frames). 跳过...")
@@ -228,8 +240,9 @@ def main():
                 print(f"⚠️ [Episode {epi}] 发现中断进度，将从帧号 {start_frame} 继续采集 {segment_name}...")
             else:
                 print(f"🚀 [Episode {epi}] 开始新采集: {segment_name}")
-                os.makedirs(img_dir, exist_ok=True)
-                os.makedirs(json_dir, exist_ok=True)
+                if not args.tar_shards:
+                    os.makedirs(img_dir, exist_ok=True)
+                    os.makedirs(json_dir, exist_ok=True)
 
             # 3. 准备 TM (同步模式)
             tm = client.get_trafficmanager(args.tm_port)
@@ -237,7 +250,10 @@ def main():
             tm.set_random_device_seed(args.seed)
 
             # 4. 生成 Ego
-            ego_vehicle = _spawn_ego(world, tm, rng)
+            # carla.Map 对同一个 world 不变，本 episode 只取一次，ego 生成/生成器/坏路过滤共用
+            cmap = world.get_map()
+            bad_road_ids = map_utils.get_bad_road_ids(town)
+            ego_vehicle = _spawn_ego(world, tm, rng, carla_map=cmap)
             print(f"[Episode {epi}] Town={town} Ego spawned: {ego_vehicle.id}")
 
             # #[新增] 环境配置(Weather & Scene)
@@ -279,7 +295,7 @@ def main():
 
             # 7. 准备生成器
             K = GeometryUtils.build_projection_matrix(W, H, FOV)
-            generator = OpenLaneGenerator(world, camera_k=K)
+            generator = OpenLaneGenerator(world, camera_k=K, carla_map=cmap)
 
             if args.segment_name is not None and args.episodes == 1:
                 segment_name = args.segment_name
@@ -289,25 +305,69 @@ def main():
             split_name = args.split
             img_dir = os.path.join(output_dir, "images", split_name, segment_name)
             json_dir = os.path.join(output_dir, "lane3d_1000", split_name, segment_name)
-            os.makedirs(img_dir, exist_ok=True)
-            os.makedirs(json_dir, exist_ok=True)
+            # 图片/json 交给后台线程写盘，主循环不再被磁盘 I/O 阻塞
+            if args.tar_shards:
+                # 续采时从新分片开始，不去追加可能没写完的旧 tar
+                sink = TarShardWriter(shard_dir, segment_name, shard_size=args.shard_size, first_shard=next_shard)
+                writer = AsyncFrameWriter(maxsize=64, num_threads=2, sink=sink)
+            else:
+                os.makedirs(img_dir, exist_ok=True)
+                os.makedirs(json_dir, exist_ok=True)
+                writer = AsyncFrameWriter(maxsize=64, num_threads=2)
 
             print(f"[Episode {epi}] Start recording {args.frames_per_episode} frames -> {segment_name}")
             print("[Episode] Warming up...")
             
             # 热身 tick (让车跑起来，让行人落地)
+            # 计数器照常递增，NPC 看门狗按自己的间隔 (每 100 tick) 跑，而不是 50 次全跑
             for _ in range(50):
                 world.tick()
-                npc_mgr.update(world_tick=0) # 也可以在这里让 NPC 更新
+                total_ticks += 1
+                npc_mgr.update(world_tick=total_ticks)
 
             # [关键修改 5] 设置初始帧号为读取到的进度
             frame_count = start_frame 
             last_save_loc = None
+            # 阈值比较用平方，循环里不用开方
+            min_speed_sq = args.min_speed ** 2
+            min_dist_sq = args.min_dist ** 2
 
             # ------------------- 采集主循环 -------------------
+            # 流水线：第 N 帧的 process_frame 在后台线程跑，主线程同时 tick 第 N+1 帧。
+            # process_frame 只用到拍摄时的 sensor_tf、seg 图和静态地图，不读 actor 当前状态，
+            # 所以和下一次 tick 并行是安全的。pending = (future, rgb_image, loc)
+            pending = None
+            # 路径模板每个 episode 只拼一次，循环里只做 % 格式化
+            if args.tar_shards:
+                img_tmpl, json_tmpl = "%06d.jpg", "%06d.json"
+            else:
+                img_tmpl = os.path.join(img_dir.replace('%', '%%'), "%06d.jpg")
+                json_tmpl = os.path.join(json_dir.replace('%', '%%'), "%06d.json")
+            rel_tmpl = f"{split_name}/{segment_name}/".replace('%', '%%') + "%06d.jpg"
+
+            def _save(job):
+                """等第 N 帧真值算完并入队写盘，返回是否保存"""
+                future, rgb_image, _ = job
+                result = future.result()
+                # 至少要有车道线
+                if not result.get('lane_lines'):
+                    return False
+
+                # --- 保存 ---
+                # 转换图像格式 (Carla Raw -> Numpy -> JPG)
+                # raw_data 的 memoryview 不持有 carla.Image，传感器 buffer 会被回收复用；
+                # 写盘线程可能在几帧之后才编码，所以入队前拷贝一份
+                array = np.frombuffer(rgb_image.raw_data, dtype=np.uint8)
+                array = np.reshape(array, (rgb_image.height, rgb_image.width, 4)).copy()
+
+                # 存 jpg (编码时丢掉 Alpha 通道) + json
+                result["file_path"] = rel_tmpl % frame_count
+                writer.put(img_tmpl % frame_count, array, json_tmpl % frame_count, result)
+                return True
+
             while frame_count < args.frames_per_episode:
                 # 1. 获取当前世界的真实 Frame ID (Source of Truth)
-                # world.tick() 返回的是 frame id
+                # world.tick() 返回的是 frame id；上一帧的 process_frame 此时在后台跑
                 current_frame_id = world.tick() 
                 total_ticks += 1
                 
@@ -319,57 +379,61 @@ def main():
                     target_frame_id=current_frame_id, 
                     timeout=2.0
                 )
+
+                # 3. 收上一帧的结果 (过滤要用到更新后的 last_save_loc)
+                if pending is not None:
+                    if _save(pending):
+                        frame_count += 1
+                        last_save_loc = pending[2]
+                    pending = None
+                    if frame_count >= args.frames_per_episode:
+                        break
                 
                 if rgb_image is None:
                     # 如果返回 None，说明没对齐或者超时，直接跳过，不要硬存
                     continue
 
                 # --- 过滤逻辑 ---
-                loc = ego_vehicle.get_location()
-                v = ego_vehicle.get_velocity()
-                speed = (v.x**2 + v.y**2 + v.z**2) ** 0.5
-                
-                if speed < args.min_speed:
-                    continue
-                if last_save_loc is not None and loc.distance(last_save_loc) < args.min_dist:
+                # 位姿和速度从本次 tick 的 WorldSnapshot 里一次取出
+                ego_snap = world.get_snapshot().find(ego_vehicle.id)
+                if ego_snap is not None:
+                    loc = ego_snap.get_transform().location
+                    v = ego_snap.get_velocity()
+                else:
+                    loc = ego_vehicle.get_location()
+                    v = ego_vehicle.get_velocity()
+                speed_sq = v.x * v.x + v.y * v.y + v.z * v.z
+                if speed_sq < min_speed_sq:
                     continue
+                if last_save_loc is not None:
+                    dx = loc.x - last_save_loc[0]
+                    dy = loc.y - last_save_loc[1]
+                    dz = loc.z - last_save_loc[2]
+                    if dx * dx + dy * dy + dz * dz < min_dist_sq:
+                        continue
                 
                 # Bad Road 过滤
                 if args.skip_bad_roads:
-                    wp = world.get_map().get_waypoint(loc, project_to_road=True)
+                    wp = cmap.get_waypoint(loc, project_to_road=True)
                     if wp:
-                        road_id = int(wp.road_id)
-                        if map_utils.is_bad_road_id_fast(town, road_id):
+                        if wp.road_id in bad_road_ids:
                             continue
 
-                # --- 生成真值 ---
-                result = generator.process_frame(ego_vehicle, sensor_tf, seg_image=seg_np)
-                lane_count = len(result.get('lane_lines', []))
-
                 if total_ticks % 50 == 0:
-                    print(f"[Episode {epi}] Tick {total_ticks}: Spd={speed:.1f}m/s, Lanes={lane_count}, Saved={frame_count}")
-
-                # 至少要有车道线
-                if lane_count <= 0:
-                    continue
-
-                # --- 保存 ---
-                file_id = f"{frame_count:06d}"
-                
-                # 转换图像格式 (Carla Raw -> Numpy -> JPG)
-                array = np.frombuffer(rgb_image.raw_data, dtype=np.uint8)
-                array = np.reshape(array, (rgb_image.height, rgb_image.width, 4))
-                # 存 RGB (去除 Alpha 通道)
-                cv2.imwrite(os.path.join(img_dir, f"{file_id}.jpg"), array[:, :, :3])
+                    print(f"[Episode {epi}] Tick {total_ticks}: Spd={speed_sq ** 0.5:.1f}m/s, Saved={frame_count}")
 
-                result["file_path"] = f"{split_name}/{segment_name}/{file_id}.jpg"
-                with open(os.path.join(json_dir, f"{file_id}.json"), 'w') as f:
-                    json.dump(result, f)
+                # --- 生成真值 (后台，下一轮 tick 时收结果) ---
+                pending = (frame_exe.submit(generator.process_frame, ego_vehicle, sensor_tf, seg_image=seg_np),
+                           rgb_image, (loc.x, loc.y, loc.z))
 
-                frame_count += 1
-                last_save_loc = loc
+            # 最后一帧还在后台的话收掉
+            if pending is not None and frame_count < args.frames_per_episode:
+                if _save(pending):
+                    frame_count += 1
+            pending = None
 
             # Episode 结束清理
+            writer.close(); writer = None  # 等本 episode 的帧全部落盘
             print(f"[Episode {epi}] Done.")
             if sensor_mgr: sensor_mgr.destroy(); sensor_mgr = None
             if ego_vehicle: ego_vehicle.destroy(); ego_vehicle = None
@@ -386,6 +450,10 @@ def main():
         traceback.print_exc()
     finally:
         print("Cleaning up actors...")
+        frame_exe.shutdown(wait=True)
+        if writer:
+            try: writer.close()
+            except Exception as e: print(f"Writer Error: {e}")
         # 最后的兜底清理
         try:
             if world:
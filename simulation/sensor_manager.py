@@ -1,6 +1,7 @@
 import carla
 import numpy as np
-import queue
+import threading
+import time
 import weakref
 import logging
 
@@ -11,13 +12,17 @@ logger = logging.getLogger(__name__)
 class SensorWrapper(object):
     """
     仿照 uploaded/sensor.py 的设计：
-    1. 拥有独立的 Queue
+    1. 回调把数据按 frame id 存进字典，用 Condition 通知等待方
     2. 使用 weakref 避免内存泄漏
-    3. 支持按 Frame ID 检索数据的“追赶”机制
+    3. 按 Frame ID 直接取目标帧，旧帧在取数时一并丢弃
     """
+    MAX_PENDING = 8  # 最多缓存的帧数 (同步模式下只会取最新 tick 的帧，更旧的帧没有用)
+
     def __init__(self, parent_actor, sensor_bp, transform, attach_to):
         self.name = sensor_bp.id
-        self.queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._frames = {}      # frame id -> data
+        self._latest = -1      # 收到的最大 frame id
         self.sensor = parent_actor.spawn_actor(sensor_bp, transform, attach_to=attach_to)
         
         # [成熟方案] 使用 weakref 防止循环引用导致的内存泄漏
@@ -27,50 +32,56 @@ class SensorWrapper(object):
 
     @staticmethod
     def _on_data(weak_self, data):
-        """静态回调函数，仅负责推入数据"""
+        """静态回调函数，仅负责存入数据并唤醒等待方"""
         self = weak_self()
         if not self:
             return
-        # 仅做最轻量的数据入队
-        self.queue.put(data)
+        with self._cond:
+            self._frames[data.frame] = data
+            if data.frame > self._latest:
+                self._latest = data.frame
+            if len(self._frames) > self.MAX_PENDING:
+                del self._frames[min(self._frames)]
+            self._cond.notify_all()
+
+    def _drop_before(self, frame):
+        for f in [f for f in self._frames if f < frame]:
+            del self._frames[f]
 
     def get_data(self, target_frame, timeout=2.0):
         """
         [核心机制] 获取指定帧的数据
         参考 sensor.py 的 save_to_disk 逻辑：
-        循环丢弃旧帧 (sensor_frame < target_frame)，直到追上目标帧。
+        比目标帧旧的数据直接丢弃；已经收到更新的帧却没有目标帧，说明错过了。
         """
-        while True:
-            try:
-                # 阻塞等待数据
-                data = self.queue.get(block=True, timeout=timeout)
-                
-                # [关键] 丢弃旧帧 (Drop-Old Strategy)
-                if data.frame < target_frame:
-                    # logger.debug(f"{self.name}: Dropping old frame {data.frame}, target is {target_frame}")
-                    continue
-                
-                # 如果拿到的是未来帧（极少见），说明错过了目标帧，或者逻辑错位
-                if data.frame > target_frame:
-                    logger.warning(f"{self.name}: Missed frame {target_frame}, got {data.frame} instead.")
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                data = self._frames.pop(target_frame, None)
+                if data is not None:
+                    self._drop_before(target_frame)
+                    return data
+
+                # 如果已经收到未来帧，说明错过了目标帧，或者逻辑错位
+                if self._latest > target_frame:
+                    self._drop_before(target_frame)
+                    logger.warning(f"{self.name}: Missed frame {target_frame}, got {self._latest} instead.")
                     return None # 这一帧这一个传感器没对齐，返回空
 
-                # 刚好命中
-                if data.frame == target_frame:
-                    return data
-                    
-            except queue.Empty:
-                logger.warning(f"{self.name}: Timeout waiting for frame {target_frame}")
-                return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"{self.name}: Timeout waiting for frame {target_frame}")
+                    return None
+                self._cond.wait(remaining)
 
     def destroy(self):
         if self.sensor and self.sensor.is_alive:
             self.sensor.stop()
             self.sensor.destroy()
         self.sensor = None
-        # 清空队列断开引用
-        with self.queue.mutex:
-            self.queue.queue.clear()
+        # 清空缓存断开引用
+        with self._cond:
+            self._frames.clear()
 
 
 class SyncSensorManager:
@@ -105,7 +116,7 @@ class SyncSensorManager:
         [修改接口] 现在需要传入 target_frame_id
         管理器向三个传感器分别“索要”同一帧的数据。
         """
-        # 1. 并行/串行获取数据（由于 Queue 是线程安全的，串行调用 get 也会很快，因为数据通常已经在里面了）
+        # 1. 串行获取数据（数据通常已经到了，等待只发生在还没到的传感器上）
         rgb_data = self.rgb_wrapper.get_data(target_frame_id, timeout)
         depth_data = self.depth_wrapper.get_data(target_frame_id, timeout)
         seg_data = self.seg_wrapper.get_data(target_frame_id, timeout)
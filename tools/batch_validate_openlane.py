@@ -27,6 +27,12 @@ from typing import Any, Dict, List, Tuple, Optional
 
 import numpy as np
 
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
 
 # -----------------------------
 # Fixed transform from your preprocess
@@ -340,6 +346,22 @@ def load_frame(path: str) -> Dict[str, Any]:
     raise ValueError("Empty file")
 
 
+def iter_frames(path: str):
+    """
+    Yield (name, frame) for every frame stored in `path`.
+    A .jsonl file is read once and each non-empty line is one frame, named
+    "<path>:<lineno>"; any other file is a single frame (see load_frame).
+    """
+    if not path.endswith(".jsonl"):
+        yield path, load_frame(path)
+        return
+    with open(path, "rb") as f:
+        lines = f.read().splitlines()
+    for lineno, line in enumerate(lines, 1):
+        if line.strip():
+            yield f"{path}:{lineno}", _loads(line)
+
+
 def write_csv(reports: List[FrameReport], out_csv: str):
     import csv
     os.makedirs(os.path.dirname(out_csv) or ".", exist_ok=True)
@@ -381,9 +403,8 @@ def main():
 
     reports: List[FrameReport] = []
     for p in files:
-        frame = load_frame(p)
-        rep = validate_frame(frame, p, args.w, args.h)
-        reports.append(rep)
+        for name, frame in iter_frames(p):
+            reports.append(validate_frame(frame, name, args.w, args.h))
 
     # summary
     ok_count = sum(1 for r in reports if r.ok)
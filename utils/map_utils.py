@@ -194,7 +194,7 @@ def pick_town_for_episode(town_list: List[str],
 # ============================================================
 
 _road_to_lane_count_cache = {}  # (town_key) -> dict[road_id] = lane_count
-_bad_road_cache = {}            # (town_key) -> set(road_id)
+_bad_road_cache = {}            # (town_key) -> frozenset(road_id)
 
 
 def _build_cache_for_town(town_name: str):
@@ -207,7 +207,7 @@ def _build_cache_for_town(town_name: str):
 
     if not hasattr(sys.modules[__name__], tkey):
         _road_to_lane_count_cache[tkey] = {}
-        _bad_road_cache[tkey] = set()
+        _bad_road_cache[tkey] = frozenset()
         return
 
     town_cls = getattr(sys.modules[__name__], tkey)
@@ -218,7 +218,7 @@ def _build_cache_for_town(town_name: str):
             road2count[int(rid)] = int(count)
 
     _road_to_lane_count_cache[tkey] = road2count
-    _bad_road_cache[tkey] = set(int(r) for r in getattr(town_cls, "bad_road_ids", []))
+    _bad_road_cache[tkey] = frozenset(int(r) for r in getattr(town_cls, "bad_road_ids", []))
 
 
 def get_gt_lane_count_fast(town_name: str, road_id: int) -> int:
@@ -238,7 +238,17 @@ def is_bad_road_id_fast(town_name: str, road_id: int) -> bool:
     """
     _build_cache_for_town(town_name)
     tkey = town_key_for_gt(town_name)
-    return int(road_id) in _bad_road_cache.get(tkey, set())
+    return int(road_id) in _bad_road_cache.get(tkey, frozenset())
+
+
+def get_bad_road_ids(town_name: str) -> frozenset:
+    """
+    Bad road ids of a town as a frozenset (empty if town unknown).
+    Fetch once per episode and test `road_id in ids` in the per-frame loop,
+    skipping the town-name normalization done by is_bad_road_id_fast.
+    """
+    _build_cache_for_town(town_name)
+    return _bad_road_cache.get(town_key_for_gt(town_name), frozenset())
 
 class Town01:
     """